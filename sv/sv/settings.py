@@ -163,6 +163,10 @@ CACHES = {
         }
     }
 }
+# 启用进程内缓存的缓存名称 {名称: {'max_size': 条数, 'ttl': 秒}}
+LOCAL_CACHES = {
+    'base_common_cache': {'max_size': 4096, 'ttl': 1},
+}
 
 
 ASGI_APPLICATION = 'sv.routing.application'
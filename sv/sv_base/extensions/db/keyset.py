@@ -0,0 +1,204 @@
+"""
+键集(游标)分页
+
+按排序字段值定位分页位置，查询代价与页码深度无关。排序字段可以为空，空值按数据库的空值排序位置定位，
+排序末尾自动补充主键保证位置唯一。
+"""
+import base64
+import datetime
+import json
+from functools import reduce
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+
+from sv_base.utils.base.text import ec, dc
+
+
+def get_keyset_ordering(queryset, ordering=None):
+    """获取键集分页排序字段
+
+    :param queryset: 查询queryset
+    :param ordering: 指定排序字段，默认使用queryset排序
+    :return: 排序字段列表，以主键结尾
+    """
+    if isinstance(ordering, str):
+        ordering = [ordering]
+
+    ordering = ordering or queryset.query.order_by or queryset.model._meta.ordering or []
+    ordering = [field for field in ordering if isinstance(field, str) and field != '?']
+
+    pk_name = queryset.model._meta.pk.name
+    if not any(field.lstrip('-') in ('pk', pk_name) for field in ordering):
+        ordering.append(pk_name)
+
+    return ordering
+
+
+def get_keyset_values(instance, ordering):
+    """获取实例在排序字段上的值
+
+    :param instance: 实例对象
+    :param ordering: 排序字段列表
+    :return: 字段值列表
+    """
+    values = []
+    for field in ordering:
+        names = field.lstrip('-').split('__')
+        obj = instance
+        for name in names[:-1]:
+            obj = getattr(obj, name, None)
+            if obj is None:
+                break
+
+        if obj is None:
+            values.append(None)
+        elif names[-1] == 'pk':
+            values.append(obj.pk)
+        else:
+            values.append(obj.serializable_value(names[-1]))
+
+    return values
+
+
+def keyset_filter(queryset, ordering, values, reverse=False):
+    """过滤出排在指定位置之后(reverse为之前)的数据
+
+    :param queryset: 查询queryset
+    :param ordering: 排序字段列表
+    :param values: 位置的排序字段值列表
+    :param reverse: 是否反向
+    :return: 查询queryset
+    """
+    # 空值在升序中排在最后(postgresql/oracle)或最前(mysql/sqlite)
+    nulls_largest = connections[queryset.db].features.nulls_order_largest
+    conditions = []
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        ascending = field.startswith('-') == reverse
+        # 空值是否排在当前方向的后面
+        nulls_after = ascending == nulls_largest
+        value = values[i]
+        if value is None:
+            if nulls_after:
+                continue
+            condition = Q(**{f'{name}__isnull': False})
+        else:
+            condition = Q(**{f'{name}__{"gt" if ascending else "lt"}': value})
+            if nulls_after:
+                condition |= Q(**{f'{name}__isnull': True})
+
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            prev_name = prev_field.lstrip('-')
+            if prev_value is None:
+                condition &= Q(**{f'{prev_name}__isnull': True})
+            else:
+                condition &= Q(**{prev_name: prev_value})
+        conditions.append(condition)
+
+    if not conditions:
+        return queryset.none()
+
+    return queryset.filter(reduce(lambda a, b: a | b, conditions))
+
+
+# 游标中保留完整精度的类型，DjangoJSONEncoder会把时间截断到毫秒
+_CURSOR_TYPES = {
+    'datetime': (datetime.datetime, parse_datetime),
+    'date': (datetime.date, parse_date),
+    'time': (datetime.time, parse_time),
+}
+
+
+def _encode_cursor_value(value):
+    for type_name, (value_type, _) in _CURSOR_TYPES.items():
+        if isinstance(value, value_type):
+            return {'t': type_name, 'v': value.isoformat()}
+
+    return value
+
+
+def _decode_cursor_value(value):
+    if isinstance(value, dict):
+        _, parse = _CURSOR_TYPES[value['t']]
+        return parse(value['v'])
+
+    return value
+
+
+def encode_cursor(values, reverse=False):
+    """生成不透明游标
+
+    :param values: 位置的排序字段值列表
+    :param reverse: 是否反向
+    :return: 游标字符串
+    """
+    values = [_encode_cursor_value(value) for value in values]
+    data = json.dumps([values, reverse], cls=DjangoJSONEncoder, separators=(',', ':'))
+    return dc(base64.urlsafe_b64encode(ec(data)))
+
+
+def decode_cursor(cursor):
+    """解析游标
+
+    :param cursor: 游标字符串
+    :return: 位置的排序字段值列表, 是否反向
+    """
+    try:
+        values, reverse = json.loads(dc(base64.urlsafe_b64decode(ec(cursor))))
+        if not isinstance(values, list):
+            raise ValueError(f'invalid cursor: {cursor}')
+
+        values = [_decode_cursor_value(value) for value in values]
+    except Exception:
+        raise ValueError(f'invalid cursor: {cursor}')
+
+    return values, bool(reverse)
+
+
+def paginate_keyset(queryset, ordering, page_size, cursor=None, iterator=False):
+    """键集分页
+
+    :param queryset: 查询queryset
+    :param ordering: 排序字段列表，需以唯一字段结尾
+    :param page_size: 每页数量
+    :param cursor: 游标，None为第一页
+    :param iterator: 使用不缓存结果的iterator查询(存在prefetch_related时无效)
+    :return: 该页实例列表, 下一页游标, 上一页游标
+    """
+    values, reverse = decode_cursor(cursor) if cursor else (None, False)
+    if values is not None and len(values) != len(ordering):
+        raise ValueError(f'invalid cursor: {cursor}')
+
+    if reverse:
+        queryset = queryset.order_by(*[field[1:] if field.startswith('-') else f'-{field}' for field in ordering])
+    else:
+        queryset = queryset.order_by(*ordering)
+
+    if values is not None:
+        queryset = keyset_filter(queryset, ordering, values, reverse)
+
+    queryset = queryset[:page_size + 1]
+    if iterator and not queryset._prefetch_related_lookups:
+        rows = list(queryset.iterator(page_size + 1))
+    else:
+        rows = list(queryset)
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    if not rows:
+        return rows, None, None
+
+    if reverse:
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, values is not None
+
+    next_cursor = encode_cursor(get_keyset_values(rows[-1], ordering)) if has_next else None
+    previous_cursor = encode_cursor(get_keyset_values(rows[0], ordering), reverse=True) if has_previous else None
+
+    return rows, next_cursor, previous_cursor
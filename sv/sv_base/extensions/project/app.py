@@ -12,7 +12,7 @@ from channels.routing import URLRouter
 from sv_base.utils.base.thread import async_exe, async_exe_once
 from sv_base.extensions.rest.routers import rest_path
 from sv_base.extensions.websocket.routers import ws_path
-from sv_base.extensions.service.message import get_message_listener
+from sv_base.extensions.service.message import get_message_listeners
 
 
 logger = logging.getLogger(__name__)
@@ -250,12 +250,52 @@ def get_sv_routers():
     return patterns
 
 
+def _get_module_subscribers(subscribers_module):
+    """获取模块中的消息订阅
+
+    :param subscribers_module: 订阅模块
+    :return: 消息识别key, 回调函数, 消息上下文识别key, 监听组列表
+    """
+    subscribers = []
+    for _, potential_subscriber in inspect.getmembers(subscribers_module, callable):
+        if hasattr(potential_subscriber, '_message_listener_key'):
+            # 未指定监听组时使用订阅模块名称
+            group = getattr(potential_subscriber, '_message_listener_group', None) or subscribers_module.__name__
+            subscribers.append((potential_subscriber._message_listener_key, potential_subscriber,
+                                potential_subscriber._message_listener_context_key, group))
+
+    return subscribers
+
+
+def _group_subscribers(subscribers):
+    """同一消息识别key和监听组的订阅合并为一个监听器
+
+    :param subscribers: 消息识别key, 回调函数, 消息上下文识别key, 监听组列表
+    :return: 消息监听器列表
+    """
+    listeners = {}
+    for key, callback, context_key, group in subscribers:
+        listeners.setdefault((key, group), []).append((callback, context_key))
+
+    return [get_message_listeners(key, key_listeners, group=group)
+            for (key, group), key_listeners in listeners.items()]
+
+
 def get_app_subscribers(app_name):
     """获取app消息订阅路由
 
     :param app_name: app名称
     :return: 子模块对应路由
     """
+    return _group_subscribers(_get_app_subscribers(app_name))
+
+
+def _get_app_subscribers(app_name):
+    """获取app子模块的消息订阅
+
+    :param app_name: app名称
+    :return: 消息识别key, 回调函数, 消息上下文识别key列表
+    """
     patterns = []
     for sub_module_name in settings.SUB_MODULES:
         # 检查收集子模块的路由文件
@@ -268,12 +308,7 @@ def get_app_subscribers(app_name):
         except ImportError as e:
             _handle_import_error(e, subscribers_name)
         else:
-            for _, potential_subscriber in inspect.getmembers(subscribers_module, callable):
-                if hasattr(potential_subscriber, '_message_listener_key'):
-                    patterns.append(
-                        get_message_listener(potential_subscriber._message_listener_key, potential_subscriber,
-                                             potential_subscriber._message_listener_context_key)
-                    )
+            patterns.extend(_get_module_subscribers(subscribers_module))
 
     return patterns
 
@@ -294,17 +329,12 @@ def get_sv_subscribers():
         except ImportError as e:
             _handle_import_error(e, subscribers_name)
         else:
-            for _, potential_subscriber in inspect.getmembers(subscribers_module, callable):
-                if hasattr(potential_subscriber, '_message_listener_key'):
-                    patterns.append(
-                        get_message_listener(potential_subscriber._message_listener_key, potential_subscriber,
-                                             potential_subscriber._message_listener_context_key)
-                    )
+            patterns.extend(_get_module_subscribers(subscribers_module))
 
         # 收集子模块的路由
-        patterns.extend(get_app_subscribers(app_name))
+        patterns.extend(_get_app_subscribers(app_name))
 
-    return patterns
+    return _group_subscribers(patterns)
 
 
 def sync_init(app_name):
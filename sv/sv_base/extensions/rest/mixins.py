@@ -9,8 +9,9 @@ from rest_framework import exceptions, mixins, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from sv_base.utils.base.cache import CacheProduct
-from sv_base.utils.base.text import md5
+from sv_base.utils.base.cache import (CacheProduct, get_tag_versions, check_tag_versions, invalidate_tags,
+                                     get_or_set_cache)
+from sv_base.utils.base.text import fast_hash
 from sv_base.extensions.rest.pagination import VueTablePagination, CacheVueTablePagination
 from sv_base.extensions.rest.request import RequestData
 
@@ -78,35 +79,105 @@ class SVMixin(metaclass=BaseMixin):
         return serializer_class(*args, **kwargs)
 
 
-def _generate_cache_key(view, queryset):
+def _get_params_key_str(view, with_page):
+    """根据声明的请求参数生成key字符串，代替渲染SQL
+
+    :param view: viewset实例
+    :param with_page: 是否包含分页位置
+    :return: key字符串
+    """
+    query_params = view.request.query_params
+    paginator = view.paginator
+    page_params = {getattr(paginator, name, None) for name in ('limit_query_param', 'offset_query_param',
+                                                                'page_query_param', 'page_size_query_param')}
+    if view.cache_key_params is True:
+        names = [name for name in query_params.keys() if name not in page_params]
+    else:
+        names = view.cache_key_params
+
+    params = sorted((name, query_params.getlist(name)) for name in names if name in query_params)
+    data = [params, sorted(view.kwargs.items())]
+    if with_page:
+        data.append([paginator.offset, paginator.limit])
+
+    return json.dumps(data, default=str)
+
+
+def _generate_cache_key(view, queryset, with_page=True):
     view_name = view.__class__.__name__
-    try:
-        key_str = queryset.query.__str__()
-    except EmptyResultSet:
-        # 无查询的空对象
-        key_str = 'EmptyResultSet'
+    if getattr(view, 'cache_key_params', None) is not None:
+        key_str = _get_params_key_str(view, with_page)
+    else:
+        try:
+            key_str = queryset.query.__str__()
+        except EmptyResultSet:
+            # 无查询的空对象
+            key_str = 'EmptyResultSet'
 
     query_data_fields = getattr(view, 'query_data_fields', [])
     query_data_fields.sort()
-    key_str = '%s:%s' % (key_str, md5(json.dumps(query_data_fields)))
+    key_str = '%s:%s' % (key_str, json.dumps(query_data_fields))
 
     cache_key_prefix = view.get_cache_key_prefix()
     if cache_key_prefix is not None:
         key_str = '%s:%s' % (cache_key_prefix, key_str)
 
-    return md5('%s:%s' % (view_name, key_str))
+    return fast_hash('%s:%s' % (view_name, key_str))
 
 
 def _generate_cache_view_name(view_cls):
     return "%s.%s" % (view_cls.__module__, view_cls.__name__)
 
 
+# 带标签版本的缓存数据标识
+CACHE_TAGS_KEY = '__cache_tags'
+# 列表缓存过期后仍可返回旧数据的时间，标签失效的数据不返回
+DEFAULT_PAGE_CACHE_STALE_AGE = 60
+
+
+def get_model_cache_tag(model):
+    """表级缓存标签，新增、删除数据时失效
+
+    :param model: 模型类
+    :return: 标签
+    """
+    return f'model:{model._meta.label_lower}'
+
+
+def get_instance_cache_tag(instance):
+    """数据级缓存标签，更新数据时失效
+
+    :param instance: 模型实例
+    :return: 标签
+    """
+    return f'model:{instance._meta.label_lower}:{instance.pk}'
+
+
+def _check_tagged_value(value):
+    return isinstance(value, dict) and CACHE_TAGS_KEY in value and check_tag_versions(value[CACHE_TAGS_KEY])
+
+
+def _clear_view_cache(view, model=None):
+    if not hasattr(view, 'clear_cache'):
+        return
+
+    if model is not None and hasattr(view, 'get_cache_tags'):
+        view.clear_cache(view.get_cache_tags(model))
+    else:
+        view.clear_cache()
+
+
 class CacheModelMixin:
     """
     viewset缓存混入类
     """
     pagination_class = CacheVueTablePagination
     page_cache = True
+    # 更新数据时失效表级标签，列表过滤或排序依赖可更新字段时开启
+    update_invalidate_model = False
+    # 生成列表缓存key的请求参数名称，True为全部参数，None渲染SQL生成key；
+    # 查询集还依赖请求参数以外的条件(如当前用户)时需通过get_cache_key_prefix区分
+    cache_key_params = None
 
     def __new__(cls, *args, **kwargs):
         obj = super(CacheModelMixin, cls).__new__(cls)
@@ -119,7 +190,7 @@ class CacheModelMixin:
         return _generate_cache_key(self, self.paginator.page_queryset)
 
     def _default_generate_count_cache_key(self):
-        return _generate_cache_key(self, self.paginator.queryset)
+        return _generate_cache_key(self, self.paginator.queryset, with_page=False)
 
     def get_cache_key_prefix(self):
         return None
@@ -135,8 +206,50 @@ class CacheModelMixin:
     def get_cache_age(self):
         return getattr(self, 'page_cache_age', settings.DEFAULT_CACHE_AGE)
 
-    def clear_cache(self):
-        self.cache.reset()
+    def get_cache_tags(self, model, instances=None):
+        """获取缓存数据依赖的标签
+
+        :param model: 模型类
+        :param instances: 数据实例列表
+        :return: 标签列表
+        """
+        tags = [get_model_cache_tag(model)]
+        tags.extend(get_instance_cache_tag(instance) for instance in instances or () if instance.pk is not None)
+        return tags
+
+    def get_cache_stale_age(self):
+        return getattr(self, 'page_cache_stale_age', DEFAULT_PAGE_CACHE_STALE_AGE)
+
+    def get_or_set_tagged_cache(self, key, compute, get_tags):
+        """获取标签版本未变化的缓存数据，不存在时只由一个请求计算，过期后短时间内返回旧数据
+
+        :param key: 缓存key
+        :param compute: 计算缓存数据的方法
+        :param get_tags: 获取依赖标签的方法，在计算前调用
+        :return: 缓存数据
+        """
+        def compute_tagged():
+            # 计算前读取标签版本，计算期间的更新使缓存数据失效
+            versions = get_tag_versions(get_tags())
+            return {
+                CACHE_TAGS_KEY: versions,
+                'data': compute(),
+            }
+
+        value = get_or_set_cache(self.cache, key, compute_tagged, timeout=self.get_cache_age(),
+                                 stale_age=self.get_cache_stale_age(), validate=_check_tagged_value)
+        return value['data']
+
+    def clear_cache(self, tags=None):
+        """清除缓存
+
+        :param tags: 失效的标签列表，None清除该viewset全部缓存
+        """
+        if tags is None:
+            self.cache.reset()
+        else:
+            invalidate_tags(tags)
+
         if hasattr(self, 'related_cache_classes'):
             self.clear_cls_cache(self.related_cache_classes)
 
@@ -186,12 +299,11 @@ class CacheModelMixin:
         paginate_queryset_flag = self.paginate_queryset_flag(queryset)
         if paginate_queryset_flag:
             if self.get_cache_flag():
-                cache_value = self.cache.get(self.cache_key)
-                if cache_value:
-                    data = cache_value
-                else:
-                    data = self._get_list_data(queryset)
-                    self.cache.set(self.cache_key, data, self.get_cache_age())
+                data = self.get_or_set_tagged_cache(
+                    self.cache_key,
+                    lambda: self._get_list_data(queryset),
+                    lambda: self.get_cache_tags(queryset.model, self.paginator.page_queryset.only('pk')),
+                )
             else:
                 data = self._get_list_data(queryset)
         else:
@@ -224,7 +336,9 @@ class CacheModelMixin:
         :param serializer: 数据序列化对象
         """
         if self.sub_perform_create(serializer):
-            self.clear_cache()
+            instance = serializer.instance
+            model = type(instance) if instance is not None else self.get_queryset().model
+            self.clear_cache(self.get_cache_tags(model))
 
     def perform_update(self, serializer):
         """更新数据
@@ -232,15 +346,20 @@ class CacheModelMixin:
         :param serializer: 数据序列化对象
         """
         if self.sub_perform_update(serializer):
-            self.clear_cache()
+            instance = serializer.instance
+            tags = [get_instance_cache_tag(instance)]
+            if self.update_invalidate_model:
+                tags.append(get_model_cache_tag(type(instance)))
+            self.clear_cache(tags)
 
     def perform_destroy(self, instance):
         """删除数据
 
         :param instance: 数据对象
         """
+        model = type(instance)
         if self.sub_perform_destroy(instance):
-            self.clear_cache()
+            self.clear_cache(self.get_cache_tags(model))
 
     def sub_perform_create(self, serializer):
         """插入数据
@@ -282,8 +401,8 @@ class DestroyModelMixin(mixins.DestroyModelMixin):
 
         :param instance: 数据实例
         """
-        if self.sub_perform_destroy(instance) and hasattr(self, 'clear_cache'):
-            self.clear_cache()
+        if self.sub_perform_destroy(instance):
+            _clear_view_cache(self, type(instance))
 
     def sub_perform_destroy(self, instance):
         """删除单条数据具体实现
@@ -309,8 +428,8 @@ class DestroyModelMixin(mixins.DestroyModelMixin):
         key = f'{self.key_field}__in'
         queryset = self.queryset.filter(**{key: values})
 
-        if self.perform_batch_destroy(queryset) and hasattr(self, 'clear_cache'):
-            self.clear_cache()
+        if self.perform_batch_destroy(queryset):
+            _clear_view_cache(self, queryset.model)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -363,8 +482,8 @@ class BatchSetModelMixin:
         key = f'{self.key_field}__in'
         queryset = self.queryset.filter(**{key: values})
 
-        if self.perform_batch_set(queryset, field, value) and hasattr(self, 'clear_cache'):
-            self.clear_cache()
+        if self.perform_batch_set(queryset, field, value):
+            _clear_view_cache(self, queryset.model)
 
         return Response(status=status.HTTP_200_OK)
 
@@ -2,8 +2,10 @@ import logging
 import math
 from collections import OrderedDict
 
-from rest_framework import pagination, response
-from rest_framework.utils.urls import replace_query_param
+from rest_framework import exceptions, pagination, response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from sv_base.extensions.db import keyset
 
 
 logger = logging.getLogger(__name__)
@@ -23,11 +25,11 @@ class CacheLimitOffsetPaginationMixin(object):
         :return: 查询总数量
         """
         if view and getattr(view, 'page_cache', False):
-            cache_key = view._default_generate_count_cache_key()
-            count = view.cache.get(cache_key)
-            if count is None:
-                count = self._get_count(queryset, view=view)
-                view.cache.set(cache_key, count, view.get_cache_age())
+            count = view.get_or_set_tagged_cache(
+                view._default_generate_count_cache_key(),
+                lambda: self._get_count(queryset, view=view),
+                lambda: view.get_cache_tags(queryset.model),
+            )
         else:
             count = self._get_count(queryset, view=view)
         return count
@@ -115,6 +117,78 @@ class CacheLimitOffsetPaginationMixin(object):
         raise NotImplementedError('Not implemented for mixin')
 
 
+class CursorPaginationMixin(object):
+    """
+    键集游标分页混入类，按排序字段定位，每页查询代价与页深度无关
+    """
+    cursor_query_param = 'cursor'
+    # 默认排序字段，未指定时使用viewset的ordering或queryset排序
+    ordering = None
+    # 是否查询总数量，总数量查询代价与数据量相关
+    count_total = False
+
+    def get_cursor_ordering(self, queryset, view=None):
+        """获取游标排序字段
+
+        :param queryset: 查询queryset
+        :param view: viewset实例
+        :return: 排序字段列表
+        """
+        ordering = None
+        if not queryset.query.order_by:
+            ordering = getattr(view, 'ordering', None) or self.ordering
+        return keyset.get_keyset_ordering(queryset, ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """分页查询
+
+        :param queryset: 查询queryset
+        :param request: 请求对象
+        :param view: viewset实例
+        :return: 该页数据
+        """
+        self.request = request
+        self.limit = self.get_limit(request, view=view)
+        self.count = self.get_count(queryset) if self.count_total else None
+        cursor = request.query_params.get(self.cursor_query_param)
+        ordering = self.get_cursor_ordering(queryset, view=view)
+        try:
+            page, self.next_cursor, self.previous_cursor = keyset.paginate_keyset(queryset, ordering, self.limit,
+                                                                                  cursor=cursor)
+        except ValueError:
+            raise exceptions.NotFound('Invalid cursor')
+
+        return page
+
+    def get_next_link(self):
+        """获取下一页链接
+
+        :return: 链接url
+        """
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_previous_link(self):
+        """获取上一页链接
+
+        :return: 链接url
+        """
+        if self.previous_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.previous_cursor)
+
+    def get_first_link(self):
+        """获取第一页链接
+
+        :return: 链接url
+        """
+        url = self.request.build_absolute_uri()
+        return remove_query_param(url, self.cursor_query_param)
+
+
 class BootstrapPagination(pagination.LimitOffsetPagination):
     """
     bootstrap数据响应
@@ -311,3 +385,58 @@ class CacheVueTablePagination(CacheLimitOffsetPaginationMixin, VueTablePaginatio
         :return: 查询偏移量
         """
         return VueTablePagination.get_offset(self, request, view=view)
+
+
+class CursorBootstrapPagination(CursorPaginationMixin, BootstrapPagination):
+    """
+    bootstrap游标分页数据响应
+    """
+
+    def get_limit(self, request, view=None):
+        """获取查询数量
+
+        :param request: 请求对象
+        :param view: viewset实例
+        :return: 查询数量
+        """
+        return BootstrapPagination.get_limit(self, request) or self.max_limit
+
+    def get_paginated_response(self, data):
+        """响应的该页数据
+
+        :param data: 该页数据
+        :return: 响应对象
+        """
+        return response.Response(OrderedDict([
+            ('total', self.count),
+            ('next', self.next_cursor),
+            ('previous', self.previous_cursor),
+            ('rows', data)
+        ]))
+
+
+class CursorVueTablePagination(CursorPaginationMixin, VueTablePagination):
+    """
+    vue table游标分页数据响应
+    """
+
+    def get_paginated_response(self, data):
+        """响应的该页数据
+
+        :param data: 该页数据
+        :return: 响应对象
+        """
+        return response.Response(OrderedDict([
+            ('links', {
+                'pagination': {
+                    'total': self.count,
+                    'per_page': self.limit,
+                    'next_cursor': self.next_cursor,
+                    'prev_cursor': self.previous_cursor,
+                    'first_page_url': self.get_first_link(),
+                    'next_page_url': self.get_next_link(),
+                    'prev_page_url': self.get_previous_link(),
+                }
+            }),
+            ('data', data)
+        ]))
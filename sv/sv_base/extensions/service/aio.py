@@ -0,0 +1,204 @@
+"""
+asyncio rpc客户端
+
+供channels消费者和异步视图使用，调用方式与get_service一致但可await:
+
+    service = get_async_service('user')
+    user = await service.get('xxx')
+    users, groups = await gather(service.batch_get(keys), get_async_service('group').get_list())
+
+当前依赖中没有asyncio原生的amqp客户端，nameko调用在有限的线程池中执行，事件循环不被阻塞；
+上下文在调用时从当前线程获取并随调用传递，压缩语义与同步客户端相同
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import translation
+from nameko.constants import LANGUAGE_CONTEXT_KEY
+from nameko.exceptions import MethodNotFound
+
+from sv_base.extensions.service.base import get_service
+from sv_base.extensions.service.codec import get_codec_names, get_compress_threshold, resolve_codec
+from sv_base.extensions.service.rpc import (get_context, set_context, compress_params, decompress_params,
+                                            compress_result, decompress_result, COMPRESS_CONTEXT_KEY)
+
+
+class NamekoRpcTransport:
+    """
+    nameko rpc调用，使用同步客户端的代理池
+    """
+
+    def __init__(self, pool_name=None):
+        self.pool_name = pool_name
+
+    def call(self, service_name, method_name, args, kwargs, context):
+        method = getattr(get_service(service_name, self.pool_name), method_name)
+        return method(*args, __context=context, **kwargs)
+
+
+class LocalRpcTransport:
+    """
+    进程内rpc调用，直接调用注册的服务对象，用于测试
+    """
+
+    def __init__(self):
+        self._services = {}
+
+    def register(self, service_name, service):
+        """
+        注册服务
+        :param service_name: 服务名称
+        :param service: 服务对象，rpc方法为其普通方法
+        :return: 无
+        """
+        self._services[service_name] = service
+
+    def unregister(self, service_name):
+        self._services.pop(service_name, None)
+
+    def call(self, service_name, method_name, args, kwargs, context):
+        service = self._services.get(service_name)
+        method = getattr(service, method_name, None) if service is not None else None
+        if method is None:
+            raise MethodNotFound(f'{service_name}.{method_name}')
+
+        context = dict(context)
+        # 按网络调用的方式压缩和解压，保持压缩语义一致
+        codec = context.pop(COMPRESS_CONTEXT_KEY, None)
+        accept_codecs = None
+        if codec:
+            codec = resolve_codec(codec)
+            accept_codecs = [codec] + [name for name in get_codec_names() if name != codec]
+            codec, args, kwargs = compress_params(args, kwargs, codec, get_compress_threshold())
+            if codec:
+                args, kwargs = decompress_params(args, kwargs, codec)
+
+        set_context(context)
+        try:
+            ret = method(*args, **kwargs)
+        finally:
+            set_context({})
+
+        if accept_codecs:
+            ret = decompress_result(compress_result(ret, accept_codecs))
+
+        return ret
+
+
+class AsyncRpcClient:
+    """
+    asyncio rpc客户端
+    """
+
+    def __init__(self, transport=None, executor=None):
+        self.transport = transport or NamekoRpcTransport()
+        self.executor = executor or get_rpc_executor()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return AsyncServiceProxy(self, name)
+
+    async def call(self, service_name, method_name, *args, **kwargs):
+        """
+        调用服务方法
+        :param service_name: 服务名称
+        :param method_name: 方法名称
+        :return: 调用结果
+        """
+        # 在调用方线程获取上下文，执行线程中不可见
+        context = dict(get_context())
+        context.setdefault(LANGUAGE_CONTEXT_KEY, translation.get_language())
+        context.update(kwargs.pop('__context', None) or {})
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self.transport.call, service_name, method_name, args,
+                                          kwargs, context)
+
+
+class AsyncServiceProxy:
+    """
+    asyncio rpc service代理
+    """
+
+    def __init__(self, client, service_name):
+        self._client = client
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return AsyncMethodProxy(self._client, self.service_name, name)
+
+
+class AsyncMethodProxy:
+    """
+    asyncio rpc service方法代理
+    """
+
+    def __init__(self, client, service_name, method_name):
+        self._client = client
+        self.service_name = service_name
+        self.method_name = method_name
+
+    def __call__(self, *args, **kwargs):
+        return self._client.call(self.service_name, self.method_name, *args, **kwargs)
+
+
+_rpc_executor = None
+_rpc_executor_lock = threading.Lock()
+
+
+def get_rpc_executor():
+    """
+    获取执行rpc调用的线程池，大小与rpc客户端代理池一致
+    :return: 线程池
+    """
+    global _rpc_executor
+    if _rpc_executor is None:
+        with _rpc_executor_lock:
+            if _rpc_executor is None:
+                _rpc_executor = ThreadPoolExecutor(max_workers=settings.NAMEKO_POOL_SIZE,
+                                                   thread_name_prefix='async-rpc')
+
+    return _rpc_executor
+
+
+_clients = {}
+
+
+def get_async_client(pool_name=None):
+    """
+    获取asyncio rpc客户端
+    :param pool_name: 配置池名称
+    :return: asyncio rpc客户端
+    """
+    client = _clients.get(pool_name)
+    if client is None:
+        client = _clients[pool_name] = AsyncRpcClient(NamekoRpcTransport(pool_name))
+
+    return client
+
+
+def get_async_service(service_name, pool_name=None):
+    """
+    获取asyncio服务对象
+    :param service_name: 服务名称
+    :param pool_name: 配置池名称
+    :return: 服务对象
+    """
+    return getattr(get_async_client(pool_name), service_name)
+
+
+async def gather(*calls, return_exceptions=False):
+    """
+    并发执行多个调用
+    :param calls: 调用协程
+    :param return_exceptions: 异常作为结果返回
+    :return: 结果列表
+    """
+    return await asyncio.gather(*calls, return_exceptions=return_exceptions)
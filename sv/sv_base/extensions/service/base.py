@@ -1,38 +1,72 @@
+import atexit
+import codecs
+import copy
+import datetime
+import json
 import logging
 import sys
+import threading
 import time
-from socket import timeout
 
 import functools
-from django.core.exceptions import ImproperlyConfigured
-from django.db import transaction
-from django.db.models import QuerySet
-from django.utils import translation
-from django_nameko.rpc import get_pool
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import DateField, DateTimeField, Model, QuerySet, TimeField, signals
+from django.utils import timezone, translation
 from nameko.constants import LANGUAGE_CONTEXT_KEY
 from nameko.events import BROADCAST, EventDispatcher
-
+from nameko.exceptions import MethodNotFound, serialize, deserialize
+from nameko.extensions import ENTRYPOINT_EXTENSIONS_ATTR
+from nameko.rpc import Rpc
+from nameko.standalone.rpc import ClusterRpcProxy
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import BaseSerializer, ModelSerializer
+from rest_framework.utils import model_meta
+
+from sv_base.extensions.db import keyset
 from sv_base.extensions.db.models import STATUS_DELETED
 from sv_base.extensions.rest.request import DataFilter
 from sv_base.extensions.service import filters
+from sv_base.extensions.service.codec import get_codec_names, get_compress_threshold, resolve_codec
 from sv_base.extensions.service.contextdata import ContextData
 from sv_base.extensions.service.rpc import (rpc, get_context, event_handler as base_event_handler, compress_params,
-                                            COMPRESS_CONTEXT_KEY)
-from sv_base.utils.base.text import rk
-from sv_base.utils.base.thread import async_exe
+                                            decompress_result, CompressedRpcReply, RpcResult, COMPRESS_CONTEXT_KEY,
+                                            COMPRESS_ACCEPT_CONTEXT_KEY, is_rpc_log_enabled, format_log_value)
+from sv_base.extensions.service.registry import OWNER_ID, get_owner_routing_key, CacheConnectionRegistry
+from sv_base.extensions.service.selector import get_socket_selector, send_all, DEFAULT_READ_SIZE
+from sv_base.extensions.service.tracing import get_tracer, CLIENT_KIND, TracedRpcReply
+from sv_base.utils.base.cache import CacheProduct, CacheStats
+from sv_base.utils.base.text import md5, rk
+from sv_base.utils.base.thread import get_shared, set_shared, get_timer_queue
 
 logger = logging.getLogger(__name__)
 
 TIMESTAMP_CONTEXT_KEY = 'timestamp'
 DEFAULT_PAGE = 1
 DEFAULT_PAGE_SIZE = 10
+DEFAULT_CHUNK_SIZE = 1000
 DEFAULT_POOL_NAME = 'default'
+DEFAULT_POOL_ACQUIRE_TIMEOUT = 30
+MULTI_CALL_METHOD = 'multi_call'
+DEFAULT_EVENT_BATCH_SIZE = 100
+DEFAULT_EVENT_FLUSH_INTERVAL = 0.05
 
 
 class ServiceBase:
     context = ContextData()
 
 
+def is_rpc_method(method):
+    """
+    是否rpc入口方法
+    :param method: 方法
+    :return: bool
+    """
+    entrypoints = getattr(method, ENTRYPOINT_EXTENSIONS_ATTR, None) or ()
+    return any(isinstance(entrypoint, Rpc) for entrypoint in entrypoints)
+
+
 class ServiceCommon(ServiceBase):
     """
     通用数据对象服务基础类
@@ -44,6 +78,12 @@ class ServiceCommon(ServiceBase):
     serializer_class = None
     # 物理删除
     physically_delete = True
+    # batch_delete逐条删除，调用实例的delete/save方法和信号
+    delete_with_signals = False
+    # batch_create允许使用bulk_create批量插入
+    enable_bulk_create = True
+    # batch_update允许使用bulk_update批量更新
+    enable_bulk_update = True
 
     search_fields = None
     enable_search_specific_fields = False
@@ -51,6 +91,50 @@ class ServiceCommon(ServiceBase):
     ordering_fields = None
     ordering = None
 
+    # 按key_name缓存get/batch_get读取的实例，适合读多写少的数据
+    instance_cache = False
+    instance_cache_age = settings.DEFAULT_CACHE_AGE
+    # 按(实例key, 修改版本, fields, context)缓存get/batch_get/get_list的序列化结果
+    serializer_cache = False
+    serializer_cache_age = settings.DEFAULT_CACHE_AGE
+
+    @rpc
+    def multi_call(self, calls):
+        """
+        批量调用本服务rpc方法，一次消息在同一worker中顺序执行
+        :param calls: 调用列表[[方法名称, args, kwargs], ...]
+        :return: 调用结果列表[{'result': 结果, 'error': 序列化的异常}, ...]
+        """
+        results = []
+        rely_callbacks = []
+        for method_name, args, kwargs in calls:
+            method = getattr(self, method_name, None)
+            if method_name == MULTI_CALL_METHOD or not is_rpc_method(method):
+                results.append({'result': None, 'error': serialize(MethodNotFound(method_name))})
+                continue
+
+            try:
+                result = method(*(args or ()), **(kwargs or {}))
+            except Exception as e:
+                results.append({'result': None, 'error': serialize(e)})
+                continue
+
+            if isinstance(result, RpcResult):
+                if result.rely_callback:
+                    rely_callbacks.append(result.rely_callback)
+                result = result.result
+
+            results.append({'result': result, 'error': None})
+
+        if rely_callbacks:
+            def rely_callback():
+                for callback in rely_callbacks:
+                    callback()
+
+            return RpcResult(results, rely_callback=rely_callback)
+
+        return results
+
     @rpc
     def get(self, key, fields=None, context=None):
         """
@@ -60,13 +144,21 @@ class ServiceCommon(ServiceBase):
         :param context: 序列化上下文
         :return: 数据
         """
-        instance = self.get_instance(key)
+        if not self.serializer_cache:
+            instance = self.get_read_instance(key)
+            if not instance:
+                return None
+
+            serializer = self.get_serializer_class()(instance=instance, fields=fields, context=context or {})
+
+            return serializer.data
+
+        versions = self.get_serializer_versions([key]) if key else None
+        instance = self.get_read_instance(key)
         if not instance:
             return None
 
-        serializer = self.get_serializer_class()(instance=instance, fields=fields, context=context or {})
-
-        return serializer.data
+        return self.serialize_instances([instance], fields=fields, context=context, versions=versions)[0]
 
     @rpc
     def batch_get(self, keys, fields=None, context=None):
@@ -77,55 +169,76 @@ class ServiceCommon(ServiceBase):
         :param context: 序列化上下文
         :return: 数据
         """
-        instances = self.get_instances_by_keys(keys)
+        versions = self.get_serializer_versions(keys) if self.serializer_cache and keys else None
+        instances = self.get_read_instances_by_keys(keys)
 
-        serializer = self.get_serializer_class()(instances, fields=fields, many=True, context=context or {})
-
-        return serializer.data
+        return self.serialize_instances(instances, fields=fields, context=context, versions=versions)
 
     @rpc
-    def get_list(self, query_params=None, fields=None, context=None, with_total=False):
+    def get_list(self, query_params=None, fields=None, context=None, with_total=False, with_cursor=False):
         """
         获取多条数据
         :param query_params: 查询参数
         :param fields: 想要获取的数据字段
         :param context: 序列化上下文
         :param with_total: 查询总数
-        :return: 多条数据
+        :param with_cursor: 使用游标分页，查询参数cursor为上次返回的游标
+        :return: 多条数据，with_total或with_cursor时为{'data': 数据, 'total': 总数, 'next': 游标, 'previous': 游标}
         """
         query_params = {} if query_params is None else query_params
-        self.query_data = DataFilter(query_params)
-
-        instances = self.get_instances(query_params)
-
-        if isinstance(instances, QuerySet):
-            if self.search_fields:
-                instances = filters.SearchFilter().filter_queryset(query_params, instances, self)
-
-            if self.enable_search_specific_fields:
-                # 模糊查询指定字段 search_field
-                instances = filters.SearchSpecificFieldsFilter().filter_queryset(query_params, instances, self)
-
-            if self.enable_ordering:
-                instances = filters.OrderingFilter().filter_queryset(query_params, instances, self)
+        queryset = instances = self.get_filtered_instances(query_params)
 
         if with_total:
             total = instances.count() if isinstance(instances, QuerySet) else len(instances)
 
-        instances = self.get_page_instances(instances, query_params)
+        if with_cursor:
+            instances, next_cursor, previous_cursor = self.get_cursor_page_instances(instances, query_params)
+        else:
+            instances = self.get_page_instances(instances, query_params)
 
-        serializer = self.get_serializer_class()(instances, fields=fields, many=True, context=context or {})
+        rows = self.serialize_page_instances(instances, queryset, fields=fields, context=context)
 
-        if with_total:
+        if with_total or with_cursor:
             data = {
-                'data': serializer.data,
-                'total': total,
+                'data': rows,
             }
+            if with_total:
+                data['total'] = total
+            if with_cursor:
+                data['next'] = next_cursor
+                data['previous'] = previous_cursor
         else:
-            data = serializer.data
+            data = rows
 
         return data
 
+    @rpc
+    def get_list_chunk(self, query_params=None, fields=None, context=None, chunk_size=DEFAULT_CHUNK_SIZE, after=None):
+        """
+        分块获取多条数据，按排序键集返回after之后的一块数据，内存占用与数据总量无关
+        :param query_params: 查询参数
+        :param fields: 想要获取的数据字段
+        :param context: 序列化上下文
+        :param chunk_size: 每块数据条数
+        :param after: 上一块返回的next标记，首块为None
+        :return: {'data': 数据, 'next': 下一块标记，无更多数据为None}
+        """
+        query_params = {} if query_params is None else query_params
+        instances = self.get_filtered_instances(query_params)
+
+        if isinstance(instances, QuerySet):
+            ordering = keyset.get_keyset_ordering(instances)
+            rows, next_after, _ = keyset.paginate_keyset(instances, ordering, chunk_size, cursor=after, iterator=True)
+        else:
+            start = after or 0
+            rows = list(instances[start:start + chunk_size])
+            next_after = start + chunk_size if len(rows) == chunk_size else None
+
+        return {
+            'data': self.serialize_page_instances(rows, instances, fields=fields, context=context),
+            'next': next_after,
+        }
+
     @rpc
     def create(self, data, fields=None, context=None):
         """
@@ -142,26 +255,30 @@ class ServiceCommon(ServiceBase):
         return serializer.data
 
     @rpc
-    def batch_create(self, data, fields=None, context=None):
+    def batch_create(self, data, fields=None, context=None, batch_size=None):
         """
-        批量创建数据，效率较低
+        批量创建数据，统一校验后批量插入，不满足批量插入条件时逐条创建
         :param data: 数据内容列表
         :param fields: 想要获取的数据字段
         :param context: 序列化上下文
+        :param batch_size: 每次批量数量
         :return: 数据内容
         """
-        serializer_class = self.get_serializer_class()
-        serializers = []
-        for row in data:
-            serializer = serializer_class(data=row, fields=fields, context=context or {})
-            serializer.is_valid(raise_exception=True)
-            serializers.append(serializer)
+        serializer = self.get_serializer_class()(data=data, fields=fields, many=True, context=context or {})
+        if not serializer.is_valid():
+            # 与逐行校验一致，返回第一条校验失败数据的错误
+            errors = serializer.errors
+            if isinstance(errors, list):
+                errors = next(error for error in errors if error)
+            raise ValidationError(errors)
 
         with transaction.atomic(savepoint=False):
-            for serializer in serializers:
+            if self.can_bulk_create(serializer.child, serializer.validated_data):
+                serializer.instance = self.bulk_create_instances(serializer.validated_data, batch_size=batch_size)
+            else:
                 serializer.save()
 
-        return [serializer.data for serializer in serializers]
+        return serializer.data
 
     @rpc
     def simple_batch_create(self, data, fields=None, context=None, batch_size=None, is_return=False):
@@ -207,6 +324,7 @@ class ServiceCommon(ServiceBase):
                                                  context=context or {})
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        self.invalidate_cache([key])
 
         if getattr(instance, '_prefetched_objects_cache', None):
             instance._prefetched_objects_cache = {}
@@ -214,12 +332,13 @@ class ServiceCommon(ServiceBase):
         return serializer.data
 
     @rpc
-    def batch_update(self, data, fields=None, context=None):
+    def batch_update(self, data, fields=None, context=None, batch_size=None):
         """
-        批量更新数据
+        批量更新数据，逐行校验后按变更字段分组批量更新
         :param data: 数据内容列表
         :param fields: 想要获取的数据字段
         :param context: 序列化上下文
+        :param batch_size: 每次批量数量
         :return: 数据内容
         """
         key_row = {}
@@ -243,21 +362,27 @@ class ServiceCommon(ServiceBase):
             raise ValueError(f'rows has no associated instances: {keys}')
 
         serializer_class = self.get_serializer_class()
-        serializers = []
+        serializer_list = []
         for key, (instance, row) in key_data.items():
             serializer = serializer_class(instance=instance, data=row, fields=fields, partial=True,
                                           context=context or {})
             serializer.is_valid(raise_exception=True)
-            serializers.append(serializer)
+            serializer_list.append(serializer)
 
         with transaction.atomic(savepoint=False):
-            for serializer in serializers:
-                serializer.save()
+            if serializer_list and self.can_bulk_update(serializer_list[0]):
+                self.bulk_update_instances(serializer_list, batch_size=batch_size)
+            else:
+                for serializer in serializer_list:
+                    serializer.save()
 
+            for serializer in serializer_list:
                 if getattr(serializer.instance, '_prefetched_objects_cache', None):
                     serializer.instance._prefetched_objects_cache = {}
 
-        return [serializer.data for serializer in serializers]
+            self.invalidate_cache(list(key_data.keys()))
+
+        return [serializer.data for serializer in serializer_list]
 
     @rpc
     def simple_batch_update(self, data, fields=None, context=None, batch_size=None, is_return=False):
@@ -271,15 +396,38 @@ class ServiceCommon(ServiceBase):
         :return: 数据内容
         """
         model_class = self.get_model_class()
+        # 按行数据的字段分组，每组一次bulk_update
+        pk_names = {'pk', model_class._meta.pk.name, model_class._meta.pk.attname}
+        field_groups = {}
+        save_rows = []
         objs = []
         for row in data:
             obj = model_class(**row)
             objs.append(obj)
+            names = [name for name in row if name not in pk_names]
+            if all(self._get_bulk_save_field(model_class, name) for name in names):
+                field_groups.setdefault(tuple(sorted(names)), []).append(obj)
+            else:
+                # 存在非model具体字段，加载实例逐行保存
+                save_rows.append((len(objs) - 1, model_class._meta.pk.to_python(obj.pk),
+                                  {name: row[name] for name in names}))
 
-        if data:
-            bulk_update_fields = [name for name in list(data[0].keys())
-                                  if not model_class._meta.get_field(name).primary_key]
-            objs = model_class.objects.bulk_update(objs, fields=bulk_update_fields, batch_size=batch_size)
+        with transaction.atomic(savepoint=False):
+            for field_names, group_objs in field_groups.items():
+                if field_names:
+                    model_class.objects.bulk_update(group_objs, fields=list(field_names), batch_size=batch_size)
+
+            if save_rows:
+                instances = model_class.objects.in_bulk([pk for index, pk, attrs in save_rows])
+                for index, pk, attrs in save_rows:
+                    instance = instances[pk]
+                    for name, value in attrs.items():
+                        setattr(instance, name, value)
+                    instance.save()
+                    objs[index] = instance
+
+        if data and (self.instance_cache or self.serializer_cache):
+            self.invalidate_cache(self._get_row_keys(data))
 
         if is_return:
             serializer_class = self.get_serializer_class()
@@ -300,25 +448,48 @@ class ServiceCommon(ServiceBase):
             return None
 
         self._delete_instance(instance)
+        self.invalidate_cache([key])
 
         return key
 
     @rpc
-    def batch_delete(self, keys):
+    def batch_delete(self, keys, with_signals=None):
         """
-        批量删除数据
-        :param key: 数据索引值列表
+        批量删除数据，model没有自定义删除/保存方法和保存信号时按集合删除
+        :param keys: 数据索引值列表
+        :param with_signals: 是否逐条删除以调用实例的delete/save方法和信号，默认使用delete_with_signals
         :return: 删除的索引值列表
         """
+        with_signals = self.delete_with_signals if with_signals is None else with_signals
         instances = self.get_instances_by_keys(keys)
 
-        deleted_keys = []
-        for instance in instances:
-            self._delete_instance(instance)
-            deleted_keys.append(getattr(instance, self.key_name))
+        if with_signals or not isinstance(instances, QuerySet) or not self.can_bulk_delete():
+            deleted_keys = []
+            for instance in instances:
+                self._delete_instance(instance)
+                deleted_keys.append(getattr(instance, self.key_name))
+        else:
+            with transaction.atomic(savepoint=False):
+                deleted_keys = list(instances.values_list(self.key_name, flat=True))
+                if deleted_keys:
+                    self._delete_queryset(instances)
+
+        self.invalidate_cache(deleted_keys)
 
         return deleted_keys
 
+    def _delete_queryset(self, queryset):
+        """
+        按集合删除
+        :param queryset: 查询集合
+        :return: 无
+        """
+        if self.physically_delete:
+            queryset.delete()
+        else:
+            # update不调用pre_save，auto_now字段与逐条save一样更新
+            queryset.update(status=STATUS_DELETED, **self._get_auto_now_values(queryset.model))
+
     def _delete_instance(self, instance):
         """
         删除实例
@@ -331,6 +502,245 @@ class ServiceCommon(ServiceBase):
             instance.status = STATUS_DELETED
             instance.save()
 
+    def can_bulk_delete(self):
+        """
+        是否可以按集合删除，集合删除不会调用model的delete/save方法和save信号
+        :return: bool
+        """
+        model_class = self.get_model_class()
+        if self.physically_delete:
+            return model_class.delete is Model.delete
+
+        return self._can_bulk_save_model(model_class)
+
+    def _can_bulk_save_model(self, model_class):
+        """
+        model是否允许批量保存，没有自定义save方法、多表继承和save信号
+        :param model_class: model类
+        :return: bool
+        """
+        return not (model_class.save is not Model.save or model_class._meta.parents
+                    or signals.pre_save.has_listeners(model_class) or signals.post_save.has_listeners(model_class))
+
+    def _get_auto_now_values(self, model_class):
+        """
+        获取auto_now字段的当前值
+        :param model_class: model类
+        :return: {字段名称: 当前时间}
+        """
+        values = {}
+        for field in model_class._meta.concrete_fields:
+            if not getattr(field, 'auto_now', False):
+                continue
+
+            if isinstance(field, DateTimeField):
+                values[field.name] = timezone.now()
+            elif isinstance(field, DateField):
+                values[field.name] = datetime.date.today()
+            elif isinstance(field, TimeField):
+                values[field.name] = datetime.datetime.now().time()
+
+        return values
+
+    def _can_bulk_save(self, serializer, method_name):
+        """
+        序列化对象和model是否允许批量保存，批量保存不会调用model的save方法和save信号
+        :param serializer: 单行序列化对象
+        :param method_name: 序列化保存方法名称 create/update
+        :return: bool
+        """
+        # 自定义保存或嵌套写入需逐条保存
+        if getattr(type(serializer), method_name) is not getattr(ModelSerializer, method_name):
+            return False
+
+        if any(isinstance(field, BaseSerializer) for field in serializer._writable_fields):
+            return False
+
+        # 校验数据按字段source组织，source需直接对应model字段
+        model_class = self.get_model_class()
+        info = model_meta.get_field_info(model_class)
+        for field in serializer._writable_fields:
+            source = field.source
+            if source in info.relations and info.relations[source].to_many:
+                continue
+
+            if self._get_bulk_save_field(model_class, source) is None:
+                return False
+
+        return self._can_bulk_save_model(model_class)
+
+    def _get_bulk_save_field(self, model_class, name):
+        """
+        获取可批量保存的model字段，非model具体字段（source别名、pk、点分source等）返回None
+        :param model_class: model类
+        :param name: 字段名称
+        :return: model字段
+        """
+        if name == 'pk' or '.' in name or name == '*':
+            return None
+
+        try:
+            field = model_class._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+        if not field.concrete or field.primary_key:
+            return None
+
+        return field
+
+    def can_bulk_update(self, serializer):
+        """
+        是否可以批量更新
+        :param serializer: 单行序列化对象
+        :return: bool
+        """
+        return self.enable_bulk_update and self._can_bulk_save(serializer, 'update')
+
+    def bulk_update_instances(self, serializer_list, batch_size=None):
+        """
+        按变更字段分组批量更新实例，多对多关联逐行设置
+        :param serializer_list: 校验后的单行序列化对象列表
+        :param batch_size: 每次批量数量
+        :return: 实例列表
+        """
+        model_class = self.get_model_class()
+        info = model_meta.get_field_info(model_class)
+        # bulk_update不调用pre_save，auto_now字段与逐条save一样每次更新
+        auto_now_fields = [field for field in model_class._meta.concrete_fields if getattr(field, 'auto_now', False)]
+
+        field_groups = {}
+        relations = []
+        save_serializers = []
+        for serializer in serializer_list:
+            instance = serializer.instance
+            row_fields = {}
+            for attr in serializer.validated_data:
+                if attr in info.relations and info.relations[attr].to_many:
+                    continue
+
+                row_fields[attr] = self._get_bulk_save_field(model_class, attr)
+                if row_fields[attr] is None:
+                    break
+
+            # validate等方法加入了非model字段数据，逐行保存
+            if None in row_fields.values():
+                save_serializers.append(serializer)
+                continue
+
+            changed_fields = []
+            for attr, value in serializer.validated_data.items():
+                if attr not in row_fields:
+                    relations.append((instance, attr, value))
+                    continue
+
+                field = row_fields[attr]
+                # 外键比较attname值，避免逐行查询关联对象
+                if field.is_relation:
+                    current = getattr(instance, field.attname)
+                    new = None if value is None else getattr(value, field.target_field.attname, value)
+                else:
+                    current = getattr(instance, attr)
+                    new = value
+
+                if current != new:
+                    setattr(instance, attr, value)
+                    changed_fields.append(attr)
+
+            for field in auto_now_fields:
+                field.pre_save(instance, False)
+                if field.name not in changed_fields:
+                    changed_fields.append(field.name)
+
+            if changed_fields:
+                field_groups.setdefault(tuple(sorted(changed_fields)), []).append(instance)
+
+        for field_names, instances in field_groups.items():
+            model_class.objects.bulk_update(instances, fields=list(field_names), batch_size=batch_size)
+
+        for instance, attr, value in relations:
+            getattr(instance, attr).set(value)
+
+        for serializer in save_serializers:
+            serializer.save()
+
+        return [serializer.instance for serializer in serializer_list]
+
+    def can_bulk_create(self, serializer, validated_data):
+        """
+        是否可以批量插入
+        :param serializer: 单行序列化对象
+        :param validated_data: 校验后的数据列表
+        :return: bool
+        """
+        if not self.enable_bulk_create or not validated_data:
+            return False
+
+        if not self._can_bulk_save(serializer, 'create'):
+            return False
+
+        model_class = self.get_model_class()
+
+        # 需要获取插入后的主键，不支持返回主键时通过key_name查询
+        if connection.features.can_return_ids_from_bulk_insert:
+            return True
+
+        key_field = model_class._meta.get_field(self.key_name)
+        if not (key_field.primary_key or key_field.unique):
+            return False
+
+        return all(attrs.get(self.key_name) is not None or key_field.has_default() for attrs in validated_data)
+
+    def bulk_create_instances(self, validated_data, batch_size=None):
+        """
+        批量插入实例，多对多关联批量插入中间表
+        :param validated_data: 校验后的数据列表
+        :param batch_size: 每次批量数量
+        :return: 实例列表
+        """
+        model_class = self.get_model_class()
+        info = model_meta.get_field_info(model_class)
+
+        objs = []
+        relations = []
+        for attrs in validated_data:
+            attrs = dict(attrs)
+            many_to_many = {}
+            for field_name, relation_info in info.relations.items():
+                if relation_info.to_many and field_name in attrs:
+                    many_to_many[field_name] = attrs.pop(field_name)
+
+            objs.append(model_class(**attrs))
+            relations.append(many_to_many)
+
+        model_class.objects.bulk_create(objs, batch_size=batch_size)
+
+        if any(obj.pk is None for obj in objs):
+            keys = [getattr(obj, self.key_name) for obj in objs]
+            pks = dict(model_class.objects.filter(**{f'{self.key_name}__in': keys}).values_list(self.key_name, 'pk'))
+            for obj in objs:
+                obj.pk = pks.get(getattr(obj, self.key_name))
+
+        field_names = {field_name for many_to_many in relations for field_name in many_to_many}
+        for field_name in field_names:
+            field = model_class._meta.get_field(field_name)
+            through = getattr(model_class, field_name).through
+            if (field.many_to_many and not field.auto_created and through._meta.auto_created
+                    and not signals.m2m_changed.has_listeners(through)):
+                source_attname = through._meta.get_field(field.m2m_field_name()).attname
+                target_attname = through._meta.get_field(field.m2m_reverse_field_name()).attname
+                through.objects.bulk_create([
+                    through(**{source_attname: obj.pk, target_attname: getattr(value, 'pk', value)})
+                    for obj, many_to_many in zip(objs, relations)
+                    for value in many_to_many.get(field_name, ())
+                ], batch_size=batch_size)
+            else:
+                for obj, many_to_many in zip(objs, relations):
+                    if field_name in many_to_many:
+                        getattr(obj, field_name).set(many_to_many[field_name])
+
+        return objs
+
     def get_model_class(self):
         """
         获取model类
@@ -360,6 +770,256 @@ class ServiceCommon(ServiceBase):
 
         return serializer_class
 
+    @classmethod
+    def get_service_cache(cls, name):
+        """
+        获取服务缓存
+        :param name: 缓存用途名称
+        :return: 缓存实例
+        """
+        caches = cls.__dict__.get('_service_caches')
+        if caches is None:
+            caches = cls._service_caches = {}
+
+        if name not in caches:
+            caches[name] = CacheProduct(f'service_{name}:{cls.__module__}.{cls.__qualname__}')
+
+        return caches[name]
+
+    @classmethod
+    def get_service_cache_stats(cls, name):
+        """
+        获取服务缓存命中统计
+        :param name: 缓存用途名称
+        :return: 缓存命中统计
+        """
+        stats = cls.__dict__.get('_service_cache_stats')
+        if stats is None:
+            stats = cls._service_cache_stats = {}
+
+        if name not in stats:
+            stats[name] = CacheStats()
+
+        return stats[name]
+
+    @rpc
+    def cache_stats(self):
+        """
+        获取本进程的缓存命中统计
+        :return: 缓存命中统计数据
+        """
+        return {name: stats.data() for name, stats in type(self).__dict__.get('_service_cache_stats', {}).items()}
+
+    @rpc
+    def rpc_metrics(self):
+        """
+        获取本进程的rpc耗时和数据大小统计
+        :return: rpc统计数据
+        """
+        return get_tracer().metrics()
+
+    def invalidate_cache(self, keys):
+        """
+        事务提交后清除实例缓存，更新序列化缓存版本
+        :param keys: 实例keys
+        :return: 无
+        """
+        if not keys or not (self.instance_cache or self.serializer_cache):
+            return
+
+        instance_cache = self.get_service_cache('instance') if self.instance_cache else None
+        serializer_cache = self.get_service_cache('serializer') if self.serializer_cache else None
+        cache_keys = [str(key) for key in keys]
+
+        def invalidate():
+            if instance_cache:
+                instance_cache.delete_many(cache_keys)
+            if serializer_cache:
+                serializer_cache.set_many({f'v:{key}': rk() for key in cache_keys}, self.serializer_cache_age * 2)
+
+        transaction.on_commit(invalidate)
+
+    def get_serializer_versions(self, keys):
+        """
+        获取实例的序列化缓存版本，应在读取实例前获取以避免缓存写入前的更新
+        :param keys: 实例keys
+        :return: {str(key): 版本}
+        """
+        cache = self.get_service_cache('serializer')
+        version_keys = [f'v:{key}' for key in keys]
+        versions = cache.get_many(version_keys)
+        missing_keys = [version_key for version_key in version_keys if version_key not in versions]
+        if missing_keys:
+            for version_key in missing_keys:
+                cache.add(version_key, rk(), self.serializer_cache_age * 2)
+            versions.update(cache.get_many(missing_keys))
+
+        return {version_key[2:]: version for version_key, version in versions.items()}
+
+    def get_serializer_cache_suffix(self, fields=None, context=None):
+        """
+        获取序列化缓存key的字段和上下文部分
+        :param fields: 想要获取的数据字段
+        :param context: 序列化上下文
+        :return: key后缀，上下文无法序列化时为None，不使用缓存
+        """
+        try:
+            data = json.dumps([sorted(fields) if fields is not None else None, context or {}], sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+
+        return md5(data)
+
+    def serialize_page_instances(self, instances, queryset=None, fields=None, context=None):
+        """
+        序列化分页实例，开启序列化缓存时先获取版本，未缓存的实例在获取版本后通过原查询集合读取，
+        避免读取和获取版本之间的更新以新版本缓存旧数据，并保留查询集合的annotate/select_related/prefetch_related
+        :param instances: 分页实例集合，未执行的分页查询只查询key
+        :param queryset: 分页前的查询集合
+        :param fields: 想要获取的数据字段
+        :param context: 序列化上下文
+        :return: 序列化数据列表
+        """
+        cacheable = self.serializer_cache and isinstance(queryset, QuerySet)
+        suffix = self.get_serializer_cache_suffix(fields, context) if cacheable else None
+        if suffix is None:
+            return self.serialize_instances(instances, fields=fields, context=context)
+
+        if isinstance(instances, QuerySet):
+            keys = [str(key) for key in instances.values_list(self.key_name, flat=True)]
+        else:
+            keys = [str(getattr(instance, self.key_name)) for instance in instances]
+        versions = self.get_serializer_versions(keys)
+
+        def load_instances(missing_keys):
+            return queryset.filter(**{f'{self.key_name}__in': missing_keys})
+
+        return self._serialize_cached(keys, versions, suffix, load_instances, fields=fields, context=context)
+
+    def serialize_instances(self, instances, fields=None, context=None, versions=None):
+        """
+        序列化实例集合，开启序列化缓存时只序列化未缓存的实例
+        :param instances: 实例集合
+        :param fields: 想要获取的数据字段
+        :param context: 序列化上下文
+        :param versions: 读取实例前获取的序列化缓存版本
+        :return: 序列化数据列表
+        """
+        suffix = self.get_serializer_cache_suffix(fields, context) if self.serializer_cache else None
+        if suffix is None:
+            return self.get_serializer_class()(instances, fields=fields, many=True, context=context or {}).data
+
+        key_instances = {str(getattr(instance, self.key_name)): instance for instance in instances}
+        keys = list(key_instances.keys())
+        if versions is None:
+            versions = self.get_serializer_versions(keys)
+
+        def load_instances(missing_keys):
+            return [key_instances[key] for key in missing_keys]
+
+        return self._serialize_cached(keys, versions, suffix, load_instances, fields=fields, context=context)
+
+    def _serialize_cached(self, keys, versions, suffix, load_instances, fields=None, context=None):
+        """
+        按key读取序列化缓存，读取并序列化未缓存的实例后写入缓存
+        :param keys: 实例keys
+        :param versions: 读取实例前获取的序列化缓存版本
+        :param suffix: 缓存key后缀
+        :param load_instances: 按keys读取实例的方法
+        :param fields: 想要获取的数据字段
+        :param context: 序列化上下文
+        :return: 序列化数据列表，已不存在的实例忽略
+        """
+        # 没有版本的实例不写入缓存
+        data_keys = {key: f'd:{key}:{versions[key]}:{suffix}' for key in keys if key in versions}
+
+        cache = self.get_service_cache('serializer')
+        stats = self.get_service_cache_stats('serializer')
+        cached = cache.get_many(list(data_keys.values()))
+        rows = {key: cached[data_key] for key, data_key in data_keys.items() if data_key in cached}
+        missing_keys = [key for key in keys if key not in rows]
+        stats.hit(len(rows))
+        stats.miss(len(missing_keys))
+
+        if missing_keys:
+            instances = list(load_instances(missing_keys))
+            data = self.get_serializer_class()(instances, fields=fields, many=True, context=context or {}).data
+            serialized = {}
+            for instance, row in zip(instances, data):
+                key = str(getattr(instance, self.key_name))
+                rows[key] = row
+                if key in data_keys:
+                    serialized[data_keys[key]] = row
+
+            if serialized:
+                cache.set_many(serialized, self.serializer_cache_age)
+
+        return [rows[key] for key in keys if key in rows]
+
+    def get_read_instance(self, key):
+        """
+        获取只读实例对象，开启实例缓存时优先读取缓存
+        :param key: 实例key
+        :return: 实例对象
+        """
+        if not self.instance_cache or not key:
+            return self.get_instance(key)
+
+        cache = self.get_service_cache('instance')
+        stats = self.get_service_cache_stats('instance')
+        instance = cache.get(str(key))
+        if instance is not None:
+            stats.hit()
+            return instance
+
+        stats.miss()
+        instance = self.get_instance(key)
+        if instance:
+            cache.set(str(key), instance, self.instance_cache_age)
+
+        return instance
+
+    def get_read_instances_by_keys(self, keys):
+        """
+        获取只读实例集合，开启实例缓存时优先读取缓存，结果按keys顺序排列
+        :param keys: 实例keys
+        :return: 实例集合
+        """
+        if not self.instance_cache or not keys:
+            return self.get_instances_by_keys(keys)
+
+        cache = self.get_service_cache('instance')
+        stats = self.get_service_cache_stats('instance')
+        cached = cache.get_many([str(key) for key in keys])
+        missing_keys = [key for key in keys if str(key) not in cached]
+        stats.hit(len(keys) - len(missing_keys))
+        stats.miss(len(missing_keys))
+
+        if missing_keys:
+            loaded = {str(getattr(instance, self.key_name)): instance
+                      for instance in self.get_instances_by_keys(missing_keys)}
+            if loaded:
+                cache.set_many(loaded, self.instance_cache_age)
+            cached.update(loaded)
+
+        return [cached[str(key)] for key in keys if str(key) in cached]
+
+    def _get_row_keys(self, data):
+        """
+        获取行数据对应的实例keys
+        :param data: 数据内容列表
+        :return: 实例keys
+        """
+        model_class = self.get_model_class()
+        pk_name = model_class._meta.pk.name
+        keys = [row[self.key_name] for row in data if self.key_name in row]
+        pks = [row.get('pk', row.get(pk_name)) for row in data if self.key_name not in row]
+        pks = [pk for pk in pks if pk is not None]
+        if pks:
+            keys.extend(model_class.objects.filter(pk__in=pks).values_list(self.key_name, flat=True))
+
+        return keys
+
     def get_instance(self, key):
         """
         获取实例对象
@@ -405,6 +1065,29 @@ class ServiceCommon(ServiceBase):
 
         return queryset
 
+    def get_filtered_instances(self, query_params):
+        """
+        获取搜索、排序处理后的查询实例集合
+        :param query_params: 查询参数
+        :return: 查询实例集合
+        """
+        self.query_data = DataFilter(query_params)
+
+        instances = self.get_instances(query_params)
+
+        if isinstance(instances, QuerySet):
+            if self.search_fields:
+                instances = filters.SearchFilter().filter_queryset(query_params, instances, self)
+
+            if self.enable_search_specific_fields:
+                # 模糊查询指定字段 search_field
+                instances = filters.SearchSpecificFieldsFilter().filter_queryset(query_params, instances, self)
+
+            if self.enable_ordering:
+                instances = filters.OrderingFilter().filter_queryset(query_params, instances, self)
+
+        return instances
+
     def get_page_instances(self, instances, query_params):
         """
         分页处理查询处理
@@ -423,6 +1106,28 @@ class ServiceCommon(ServiceBase):
 
         return instances
 
+    def get_cursor_page_instances(self, instances, query_params):
+        """
+        游标分页查询处理，按排序字段和主键定位，代价与页深度无关
+        :param instances: 查询集合
+        :param query_params: 查询参数
+        :return: 查询处理结果集合, 下一页游标, 上一页游标
+        """
+        query_data = DataFilter(query_params)
+        page_size = query_data.get('per_page', int, DEFAULT_PAGE_SIZE)
+        cursor = query_data.get('cursor')
+
+        if not isinstance(instances, QuerySet):
+            start = int(cursor) if cursor else 0
+            end = start + page_size
+            next_cursor = str(end) if end < len(instances) else None
+            previous_cursor = str(max(start - page_size, 0)) if start > 0 else None
+            return instances[start:end], next_cursor, previous_cursor
+
+        ordering = keyset.get_keyset_ordering(instances)
+
+        return keyset.paginate_keyset(instances, ordering, page_size, cursor=cursor)
+
 
 class EventSender(ServiceBase):
     name = 'event_sender'
@@ -436,6 +1141,20 @@ class EventSender(ServiceBase):
 
         self.dispatch(key, data, **options)
 
+    @rpc
+    def send_many(self, events):
+        """
+        批量发送事件，同一工作上下文中连续发布
+        :param events: 事件列表[(key, data, timeout)]
+        :return: 无
+        """
+        for key, data, timeout in events:
+            options = {}
+            if timeout:
+                options['expiration'] = timeout
+
+            self.dispatch(key, data, **options)
+
 
 def send_event(key, data, timeout=None, **kwargs):
     """
@@ -447,6 +1166,124 @@ def send_event(key, data, timeout=None, **kwargs):
     get_service('event_sender').send(key, data, timeout=timeout, __log=False, **kwargs)
 
 
+class EventBatchSender:
+    """
+    批量事件发送，事件数量达到batch_size或距首个事件超过flush_interval秒时合并为一次rpc调用发送
+
+    上下文不同的事件分批发送，保证事件携带发送时的上下文
+    """
+
+    def __init__(self, batch_size=DEFAULT_EVENT_BATCH_SIZE, flush_interval=DEFAULT_EVENT_FLUSH_INTERVAL,
+                 pool_name=None, timer=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pool_name = pool_name
+
+        self._lock = threading.Lock()
+        # 保证批次按顺序发送
+        self._send_lock = threading.Lock()
+        self._batches = {}
+        self._count = 0
+        self._timer = timer or get_timer_queue()
+        # 首个事件加入时设置的定时发送任务
+        self._timer_id = None
+        self._closed = False
+
+    def send(self, key, data, timeout=None, context=None):
+        """
+        添加事件
+        :param key: 事件识别key
+        :param data: 消息数据
+        :param timeout: 消息过期时间
+        :param context: 自定义上下文
+        :return: 无
+        """
+        context = dict(get_context(), **(context or {}))
+        context.setdefault(LANGUAGE_CONTEXT_KEY, translation.get_language())
+        batch_key = json.dumps(context, sort_keys=True, default=str)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('event batch sender is closed')
+
+            if batch_key not in self._batches:
+                self._batches[batch_key] = (context, [])
+            self._batches[batch_key][1].append((key, data, timeout))
+            self._count += 1
+
+            if self._timer_id is None:
+                self._timer_id = self._timer.call_later(self.flush_interval, self.flush)
+
+            full = self._count >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        发送所有待发送事件
+        :return: 无
+        """
+        with self._send_lock:
+            with self._lock:
+                batches = self._batches
+                timer_id = self._timer_id
+                self._batches = {}
+                self._count = 0
+                self._timer_id = None
+
+            if timer_id is not None:
+                self._timer.cancel(timer_id)
+
+            for context, events in batches.values():
+                try:
+                    get_service('event_sender', self.pool_name).send_many(events, __context=context, __log=False)
+                except Exception as e:
+                    logger.error('send event batch error: %s', e)
+
+    def close(self):
+        """
+        发送剩余事件并停止
+        :return: 无
+        """
+        with self._lock:
+            self._closed = True
+
+        self.flush()
+
+
+_event_batch_sender = None
+_event_batch_sender_lock = threading.Lock()
+
+
+def get_event_batch_sender():
+    """
+    获取进程内共享的批量事件发送
+    :return: 批量事件发送
+    """
+    global _event_batch_sender
+    if _event_batch_sender is None:
+        with _event_batch_sender_lock:
+            if _event_batch_sender is None:
+                _event_batch_sender = EventBatchSender(
+                    batch_size=getattr(settings, 'EVENT_BATCH_SIZE', DEFAULT_EVENT_BATCH_SIZE),
+                    flush_interval=getattr(settings, 'EVENT_FLUSH_INTERVAL', DEFAULT_EVENT_FLUSH_INTERVAL),
+                )
+                atexit.register(_event_batch_sender.close)
+
+    return _event_batch_sender
+
+
+def send_batch_event(key, data, timeout=None, context=None):
+    """
+    批量发送事件，事件合并后延迟发送
+    :param key: 事件识别key
+    :param data: 消息数据
+    :param timeout: 消息过期时间
+    :param context: 自定义上下文
+    """
+    get_event_batch_sender().send(key, data, timeout=timeout, context=context)
+
+
 def event_handler(*handler_args, **handler_kwargs):
     """
     默认event_sender
@@ -468,33 +1305,44 @@ broadcast_event_handler = functools.partial(event_handler, handler_type=BROADCAS
 class SocketServiceCommonBase(type):
     """
     通用rpc socket代理服务元类，添加事件接收
+
+    事件定向到连接归属进程的事件key，每个进程只接收自己持有的连接的事件；
+    未登记归属时发送的原事件key仍广播处理
     """
     def __new__(mcs, name, bases, attrs):
         cls = super().__new__(mcs, name, bases, attrs)
 
         if cls.listen_routing_key:
-            @broadcast_event_handler(cls.listen_routing_key)
             def listen(self, data):
                 self.receive_listen(data)
 
-            cls.listen = listen
+            mcs.add_handler(cls, 'listen', cls.listen_routing_key, listen)
 
         if cls.send_routing_key:
-            @broadcast_event_handler(cls.send_routing_key)
             def send(self, data):
                 self.receive_send(data)
 
-            cls.send = send
+            mcs.add_handler(cls, 'send', cls.send_routing_key, send)
 
         if cls.close_routing_key:
-            @broadcast_event_handler(cls.close_routing_key)
             def close(self, data):
-                self.receive_send(data)
+                self.receive_close(data)
 
-            cls.close = close
+            mcs.add_handler(cls, 'close', cls.close_routing_key, close)
 
         return cls
 
+    @staticmethod
+    def add_handler(cls, name, routing_key, func):
+        owner_routing_key = get_owner_routing_key(routing_key, OWNER_ID)
+        setattr(cls, name, broadcast_event_handler(owner_routing_key)(func))
+
+        @functools.wraps(func)
+        def broadcast(self, data):
+            return func(self, data)
+
+        setattr(cls, f'broadcast_{name}', broadcast_event_handler(routing_key)(broadcast))
+
 
 class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
     """
@@ -505,9 +1353,54 @@ class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
     send_routing_key = ''
     close_routing_key = ''
     socket_timeout = 300
-    recv_size = 1024
+    # 单次读取大小，不超过读取循环的缓冲区大小
+    recv_size = DEFAULT_READ_SIZE
+    # 同一连接连续读取的数据合并到该字节数或等待flush_interval秒后再发送
+    coalesce_size = 65536
+    flush_interval = 0.005
+    # 连接归属登记
+    connection_registry_class = CacheConnectionRegistry
     socket_pool = {}
 
+    @classmethod
+    def get_connection_registry(cls):
+        """
+        获取连接归属登记
+        :return: 连接归属登记
+        """
+        registry = cls.__dict__.get('_connection_registry')
+        if registry is None:
+            registry = cls._connection_registry = cls.connection_registry_class(cls.name)
+
+        return registry
+
+    @classmethod
+    def route_event(cls, routing_key, data, timeout=None):
+        """
+        发送连接事件到连接归属进程，未登记归属时广播
+        :param routing_key: 事件key
+        :param data: 事件数据，包含key和connection_id
+        :param timeout: 消息过期时间
+        :return: 无
+        """
+        owner_id = cls.get_connection_registry().get_owner(data.get('connection_id'))
+        if owner_id:
+            routing_key = get_owner_routing_key(routing_key, owner_id)
+
+        send_event(routing_key, data, timeout=timeout)
+
+    @classmethod
+    def route_listen(cls, key, connection_id):
+        cls.route_event(cls.listen_routing_key, {'key': key, 'connection_id': connection_id})
+
+    @classmethod
+    def route_send(cls, key, connection_id, data):
+        cls.route_event(cls.send_routing_key, {'key': key, 'connection_id': connection_id, 'data': data})
+
+    @classmethod
+    def route_close(cls, key, connection_id):
+        cls.route_event(cls.close_routing_key, {'key': key, 'connection_id': connection_id})
+
     def _connect(self, key):
         """
         连接得到socket对象
@@ -545,7 +1438,7 @@ class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
 
     def _listen(self, key, connection_id):
         """
-        监听消息
+        监听消息，注册到进程共享的socket读取循环
         :param key: 调用key
         :return: 无
         """
@@ -557,26 +1450,45 @@ class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
         sock._listening = True
         sock._stopping = False
         sock.settimeout(self.socket_timeout)
-        while True:
-            if sock._stopping:
-                break
+        # 回调在读取循环的分发线程中执行，带上监听时的共享线程变量
+        shared = get_shared()
+        get_socket_selector().register(
+            sock,
+            functools.partial(self._call_shared, shared, self._receive, key, connection_id),
+            close_callback=functools.partial(self._call_shared, shared, self.clear_socket, connection_id),
+            timeout=self.socket_timeout,
+            read_size=self.recv_size,
+            coalesce_size=self.coalesce_size,
+            flush_interval=self.flush_interval,
+        )
+
+    def _call_shared(self, shared, func, *args):
+        """
+        设置共享线程变量后调用
+        :param shared: 共享线程变量参数
+        :param func: 调用方法
+        :return: 调用结果
+        """
+        set_shared(shared)
+        return func(*args)
 
-            try:
-                resp = sock.recv(self.recv_size)
-                if resp is not None:
-                    self._send(key, connection_id, str(resp, encoding='utf-8', errors="ignore"))
-                else:
-                    logger.info("service daemon socket is close")
-            except timeout:
-                logger.warning('Receive from service socket timeout.')
-                break
-            except OSError:
-                logger.warning("service daemon socket err: EAGAIN")
-            except Exception as e:
-                logger.error("service daemon socket err: %s" % e)
-                break
+    def _receive(self, key, connection_id, data):
+        """
+        处理读取到的socket数据
+        :param key: 调用key
+        :param connection_id: 连接id
+        :param data: 数据
+        :return: 无
+        """
+        sock = self.get_socket(connection_id)
+        if not sock:
+            return
 
-        self.clear_socket(key)
+        self.renew_connection(sock)
+        # 增量解码，保留被分割的多字节字符
+        text = sock._decoder.decode(data)
+        if text:
+            self._send(key, connection_id, text)
 
     def create_socket(self, key):
         """
@@ -590,10 +1502,30 @@ class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
             sock._connection_id = connection_id
             sock._listening = False
             sock._stopping = False
+            sock._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
             self.socket_pool[connection_id] = sock
+            self.register_connection(sock)
 
         return sock
 
+    def register_connection(self, sock):
+        """
+        登记连接归属当前进程，有效期为无数据超时时间的2倍
+        :param sock: socket对象
+        :return: 无
+        """
+        sock._registered_at = time.time()
+        self.get_connection_registry().register(sock._connection_id, OWNER_ID, self.socket_timeout * 2)
+
+    def renew_connection(self, sock):
+        """
+        连接有读写活动时续期归属登记，超过无数据超时时间才重新登记
+        :param sock: socket对象
+        :return: 无
+        """
+        if time.time() - sock._registered_at > self.socket_timeout:
+            self.register_connection(sock)
+
     def get_socket(self, connection_id):
         """
         获取socket对象
@@ -612,6 +1544,8 @@ class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
         if sock:
             sock._listening = False
             sock._stopping = True
+            get_socket_selector().unregister(sock)
+            self.get_connection_registry().unregister(connection_id)
             sock.close()
 
         return sock
@@ -645,7 +1579,8 @@ class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
             return False
 
         key = data.get('key')
-        async_exe(self._listen, (key, sock._connection_id))
+        self._listen(key, sock._connection_id)
+        self.renew_connection(sock)
 
         return True
 
@@ -664,9 +1599,10 @@ class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
             return
 
         key = data.get('key')
-        async_exe(self._listen, (key, sock._connection_id))
+        self._listen(key, sock._connection_id)
+        self.renew_connection(sock)
 
-        sock.sendall(content)
+        send_all(sock, content, self.socket_timeout)
 
     def receive_close(self, data):
         """
@@ -684,20 +1620,263 @@ class SocketServiceCommon(ServiceBase, metaclass=SocketServiceCommonBase):
         self._after_close(key, sock)
 
 
+class RpcProxyPool:
+    """
+    rpc客户端代理池，长期持有已启动的代理，线程安全地跨调用复用
+    """
+
+    def __init__(self, config, pool_size, timeout=None, acquire_timeout=DEFAULT_POOL_ACQUIRE_TIMEOUT,
+                 context_data=None):
+        """
+        :param config: nameko配置
+        :param pool_size: 代理池大小
+        :param timeout: rpc调用超时时间
+        :param acquire_timeout: 获取代理的等待超时时间，None一直等待
+        :param context_data: 默认上下文
+        """
+        self.config = config
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.context_data = context_data or {}
+
+        # 空闲代理，后进先出
+        self._idle = []
+        # 空闲代理归还或代理丢弃时通知等待线程重新检查
+        self._condition = threading.Condition()
+        self._stats = {
+            'created': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'waiting': 0,
+            'wait_count': 0,
+            'wait_timeout_count': 0,
+            'discarded': 0,
+        }
+
+    def acquire(self):
+        """
+        获取一个健康的已启动代理
+        :return: 代理池代理
+        """
+        deadline = time.monotonic() + self.acquire_timeout if self.acquire_timeout is not None else None
+        while True:
+            proxy = self._get_or_create(deadline)
+            if proxy.is_healthy():
+                break
+
+            self._discard(proxy)
+
+        with self._condition:
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+
+        return proxy
+
+    def release(self, proxy, broken=False):
+        """
+        归还代理
+        :param proxy: 代理池代理
+        :param broken: 代理连接是否已损坏
+        :return: 无
+        """
+        with self._condition:
+            self._stats['in_use'] -= 1
+
+        if broken:
+            self._discard(proxy)
+        else:
+            proxy.reset_context()
+            with self._condition:
+                self._idle.append(proxy)
+                self._condition.notify()
+
+    def metrics(self):
+        """
+        代理池指标
+        :return: 指标数据
+        """
+        with self._condition:
+            data = dict(self._stats)
+            data['idle'] = len(self._idle)
+
+        data.update({
+            'size': self.pool_size,
+            'saturation': data['in_use'] / self.pool_size if self.pool_size else 0,
+        })
+        return data
+
+    def clear(self):
+        """
+        停止所有空闲代理
+        :return: 无
+        """
+        with self._condition:
+            proxies = self._idle
+            self._idle = []
+
+        for proxy in proxies:
+            self._discard(proxy)
+
+    def _get_or_create(self, deadline):
+        """
+        获取空闲代理，没有空闲代理且未满时创建，已满时等待归还或丢弃
+        :param deadline: 等待截止时间，None一直等待
+        :return: 代理池代理
+        """
+        waiting = False
+        with self._condition:
+            try:
+                while True:
+                    if self._idle:
+                        return self._idle.pop()
+
+                    if self._stats['created'] < self.pool_size:
+                        self._stats['created'] += 1
+                        break
+
+                    if not waiting:
+                        waiting = True
+                        self._stats['waiting'] += 1
+                        self._stats['wait_count'] += 1
+
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        self._stats['wait_timeout_count'] += 1
+                        raise RuntimeError(f'rpc proxy pool exhausted, size: {self.pool_size}')
+
+                    self._condition.wait(remaining)
+            finally:
+                if waiting:
+                    self._stats['waiting'] -= 1
+
+        try:
+            return PooledRpcProxy(self).start()
+        except Exception:
+            with self._condition:
+                self._stats['created'] -= 1
+                self._condition.notify()
+            raise
+
+    def _discard(self, proxy):
+        with self._condition:
+            self._stats['created'] -= 1
+            self._stats['discarded'] += 1
+            # 空出的位置可以创建新代理
+            self._condition.notify()
+
+        proxy.stop()
+
+
+class PooledRpcProxy:
+    """
+    代理池中的长连接rpc代理
+    """
+    _rpc = None
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._proxy = ClusterRpcProxy(pool.config, context_data=copy.deepcopy(pool.context_data),
+                                      timeout=pool.timeout)
+
+    def __getattr__(self, name):
+        if self._rpc is None:
+            raise AttributeError(name)
+
+        return getattr(self._rpc, name)
+
+    def start(self):
+        self._rpc = self._proxy.start()
+        return self
+
+    def stop(self):
+        self._rpc = None
+        try:
+            self._proxy.stop()
+        except Exception as e:
+            logger.warning('stop rpc proxy error: %s', e)
+
+    def is_healthy(self):
+        """
+        检查回复队列连接是否可用
+        :return: bool
+        """
+        if self._rpc is None:
+            return False
+
+        try:
+            connection = self._proxy._reply_listener.queue_consumer.connection
+        except AttributeError:
+            return True
+
+        try:
+            return connection.connected
+        except Exception:
+            return False
+
+    def reset_context(self):
+        self._proxy._worker_ctx.data = copy.deepcopy(self._pool.context_data)
+
+
+_rpc_pools = {}
+_rpc_pools_lock = threading.Lock()
+
+
+def get_rpc_pool(pool_name=None):
+    """
+    获取rpc客户端代理池
+    :param pool_name: 配置池名称
+    :return: rpc客户端代理池
+    """
+    pool_name = pool_name or DEFAULT_POOL_NAME
+    pool = _rpc_pools.get(pool_name)
+    if pool is None:
+        with _rpc_pools_lock:
+            pool = _rpc_pools.get(pool_name)
+            if pool is None:
+                pool = RpcProxyPool(
+                    get_config(settings.NAMEKO_CONFIG, name=pool_name),
+                    settings.NAMEKO_POOL_SIZE,
+                    timeout=getattr(settings, 'NAMEKO_TIMEOUT', None),
+                    acquire_timeout=getattr(settings, 'NAMEKO_POOL_TIMEOUT', DEFAULT_POOL_ACQUIRE_TIMEOUT),
+                    context_data=getattr(settings, 'NAMEKO_CONTEXT_DATA', None),
+                )
+                _rpc_pools[pool_name] = pool
+
+    return pool
+
+
+def get_rpc_pool_metrics():
+    """
+    获取所有rpc客户端代理池指标
+    :return: {配置池名称: 指标数据}
+    """
+    return {pool_name: pool.metrics() for pool_name, pool in list(_rpc_pools.items())}
+
+
+def _is_broken_error(tpe):
+    return tpe is not None and issubclass(tpe, (RuntimeError, OSError))
+
+
 class RpcProxy:
     """
     rpc客户端代理
     """
 
-    def __init__(self):
-        self._proxy = get_pool().next()
+    def __init__(self, pool_name=None):
+        self._pool = get_rpc_pool(pool_name)
+        self._proxy = self._pool.acquire()
+        self._released = False
 
     def __enter__(self):
-        self._proxy.__enter__()
         return self
 
     def __exit__(self, tpe=None, value=None, traceback=None):
-        self._proxy.__exit__(tpe, value, traceback)
+        if self._released:
+            return
+
+        self._released = True
+        self._pool.release(self._proxy, broken=_is_broken_error(tpe))
 
     def __getattr__(self, name):
         return ServiceProxy(self, getattr(self._proxy, name))
@@ -768,9 +1947,11 @@ class MethodProxy:
         return getattr(self._method, name)
 
     def _log(self, *args, **kwargs):
-        msg = f'[RPC CALLING] {self.service_name}:{self.method_name}, args: {args}, kwargs: {kwargs}, ' \
-              f'context: {self.worker_ctx.data}'
-        logger.debug(msg)
+        if not is_rpc_log_enabled(logger, self.service_name, self.method_name):
+            return
+
+        logger.debug('[RPC CALLING] %s:%s, args: %s, kwargs: %s, context: %s', self.service_name, self.method_name,
+                     format_log_value(args), format_log_value(kwargs), format_log_value(self.worker_ctx.data))
 
     def _call(self, *args, **kwargs):
         context = kwargs.pop('__context', None)
@@ -782,15 +1963,33 @@ class MethodProxy:
         if is_log:
             self._log(*args, **kwargs)
 
-        if self.worker_ctx.data.get(COMPRESS_CONTEXT_KEY):
-            args, kwargs = compress_params(args, kwargs)
+        context_data = self.worker_ctx.data
+        span = get_tracer().start_span(CLIENT_KIND, self.service_name, self.method_name, context_data, args, kwargs)
+        compress = context_data.pop(COMPRESS_CONTEXT_KEY, None)
+        if compress:
+            codec = resolve_codec(compress)
+            # 接受压缩的返回值，优先使用请求的编码
+            context_data[COMPRESS_ACCEPT_CONTEXT_KEY] = [codec] + [name for name in get_codec_names() if name != codec]
+            codec, args, kwargs = compress_params(args, kwargs, codec, get_compress_threshold())
+            if codec:
+                context_data[COMPRESS_CONTEXT_KEY] = codec
 
         try:
             if is_async:
                 ret = self._method.call_async(*args, **kwargs)
+                if compress:
+                    ret = CompressedRpcReply(ret)
+                if span:
+                    ret = TracedRpcReply(ret, span)
             else:
                 ret = self._method(*args, **kwargs)
+                if compress:
+                    ret = decompress_result(ret)
+                if span:
+                    span.finish(response=ret)
         except Exception as e:
+            if span:
+                span.finish(error=e)
             self._rpc_proxy.del_context()
             self.__exit__(type(e), e, None)
             raise
@@ -806,13 +2005,141 @@ class MethodProxy:
         return self._call(*args, **kwargs)
 
 
-def get_service(service_name):
+class RpcPipeline:
+    """
+    rpc批量调用管道，收集多个方法调用，同一服务的调用合并为一条消息发送
+    """
+
+    def __init__(self, context=None, pool_name=None):
+        self._context = context
+        self._pool_name = pool_name
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return PipelineServiceProxy(self, name)
+
+    def __len__(self):
+        return len(self._calls)
+
+    def add(self, service_name, method_name, *args, **kwargs):
+        """
+        添加调用
+        :param service_name: 服务名称
+        :param method_name: 方法名称
+        :return: 调用结果索引
+        """
+        self._calls.append((service_name, method_name, args, kwargs))
+        return len(self._calls) - 1
+
+    def execute(self, raise_exception=False):
+        """
+        执行所有调用，各服务的调用并发发送
+        :param raise_exception: 是否抛出第一个调用异常
+        :return: 按添加顺序的结果列表，调用失败的位置为异常对象
+        """
+        calls, self._calls = self._calls, []
+        if not calls:
+            return []
+
+        service_calls = {}
+        for index, (service_name, method_name, args, kwargs) in enumerate(calls):
+            service_calls.setdefault(service_name, []).append((index, [method_name, args, kwargs]))
+
+        rpc_proxy = RpcProxy(self._pool_name)
+        rpc_proxy.__enter__()
+        # 调用异常时MethodProxy已释放rpc_proxy
+        replies = []
+        for service_name, items in service_calls.items():
+            method = getattr(getattr(rpc_proxy, service_name), MULTI_CALL_METHOD)
+            reply = method.call_async([call for _, call in items], __context=self._context, __once=False)
+            replies.append((items, reply))
+
+        results = [None] * len(calls)
+        try:
+            for items, reply in replies:
+                try:
+                    service_results = reply.result()
+                except Exception as e:
+                    for index, _ in items:
+                        results[index] = e
+                    continue
+
+                for (index, _), item in zip(items, service_results):
+                    error = item.get('error')
+                    results[index] = deserialize(error) if error else item.get('result')
+        finally:
+            rpc_proxy.__exit__()
+
+        if raise_exception:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+
+        return results
+
+
+class PipelineServiceProxy:
+    """
+    rpc批量调用管道service代理
+    """
+
+    def __init__(self, pipeline, service_name):
+        self._pipeline = pipeline
+        self._service_name = service_name
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return functools.partial(self._pipeline.add, self._service_name, name)
+
+
+def get_pipeline(context=None, pool_name=None):
+    """
+    获取rpc批量调用管道
+    :param context: 自定义上下文
+    :param pool_name: 配置池名称
+    :return: rpc批量调用管道
+    """
+    return RpcPipeline(context=context, pool_name=pool_name)
+
+
+def iter_list(service_name, query_params=None, fields=None, context=None, chunk_size=DEFAULT_CHUNK_SIZE,
+              pool_name=None):
+    """
+    分块迭代获取服务的多条数据
+    :param service_name: 服务名称
+    :param query_params: 查询参数
+    :param fields: 想要获取的数据字段
+    :param context: 序列化上下文
+    :param chunk_size: 每块数据条数
+    :param pool_name: 配置池名称
+    :return: 数据块生成器
+    """
+    after = None
+    while True:
+        chunk = get_service(service_name, pool_name=pool_name).get_list_chunk(
+            query_params, fields=fields, context=context, chunk_size=chunk_size, after=after,
+        )
+        if chunk['data']:
+            yield chunk['data']
+
+        after = chunk['next']
+        if after is None:
+            break
+
+
+def get_service(service_name, pool_name=None):
     """
     获取服务对象
     :param service_name: 服务名称
+    :param pool_name: 配置池名称
     :return: 服务对象
     """
-    rpc_proxy = RpcProxy()
+    rpc_proxy = RpcProxy(pool_name)
     rpc_proxy.__enter__()
     return getattr(rpc_proxy, service_name)
 
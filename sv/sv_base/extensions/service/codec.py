@@ -0,0 +1,152 @@
+"""
+rpc数据压缩编码
+
+zlib为标准库实现，lz4、zstd在安装对应依赖后可用，不可用时回退到zlib
+"""
+import base64
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from sv_base.utils.base.text import ec, dc
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ZLIB_CODEC = 'zlib'
+LZ4_CODEC = 'lz4'
+ZSTD_CODEC = 'zstd'
+
+DEFAULT_CODEC = ZLIB_CODEC
+# 序列化后小于该字节数的数据不压缩
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+ZLIB_LEVEL = 1
+ZSTD_LEVEL = 3
+
+
+def _zlib_compress(data):
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+codecs = {
+    ZLIB_CODEC: (_zlib_compress, zlib.decompress),
+}
+
+if zstandard is not None:
+    codecs[ZSTD_CODEC] = (_zstd_compress, _zstd_decompress)
+
+if lz4_frame is not None:
+    codecs[LZ4_CODEC] = (lz4_frame.compress, lz4_frame.decompress)
+
+
+def get_codec_names():
+    """
+    获取可用的压缩编码名称，按优先级排序
+    :return: 压缩编码名称列表
+    """
+    return [name for name in (ZSTD_CODEC, LZ4_CODEC, ZLIB_CODEC) if name in codecs]
+
+
+def get_compress_threshold():
+    """
+    获取压缩阈值
+    :return: 字节数
+    """
+    return getattr(settings, 'RPC_COMPRESS_THRESHOLD', DEFAULT_COMPRESS_THRESHOLD)
+
+
+def resolve_codec(codec=None):
+    """
+    获取可用的压缩编码名称，未指定或不可用时使用配置的编码，再回退到zlib
+    :param codec: 压缩编码名称，兼容旧的True值
+    :return: 压缩编码名称
+    """
+    if isinstance(codec, str) and codec in codecs:
+        return codec
+
+    codec = getattr(settings, 'RPC_COMPRESS_CODEC', DEFAULT_CODEC)
+    if codec in codecs:
+        return codec
+
+    return DEFAULT_CODEC
+
+
+def negotiate_codec(accept_codecs):
+    """
+    从对方接受的压缩编码中选择本地可用的编码
+    :param accept_codecs: 对方接受的压缩编码名称列表
+    :return: 压缩编码名称，无可用编码为None
+    """
+    if isinstance(accept_codecs, str):
+        accept_codecs = [accept_codecs]
+
+    for codec in accept_codecs or ():
+        if codec in codecs:
+            return codec
+
+    return None
+
+
+def dumps(value):
+    """
+    序列化数据
+    :param value: 数据
+    :return: 字节
+    """
+    return ec(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def loads(data):
+    """
+    反序列化数据
+    :param data: 字节
+    :return: 数据
+    """
+    return json.loads(dc(data))
+
+
+def compress(data, codec):
+    """
+    压缩字节数据，返回可json传输的字符串
+    :param data: 字节
+    :param codec: 压缩编码名称
+    :return: base64字符串
+    """
+    compress_func = codecs[codec][0]
+    return dc(base64.b64encode(compress_func(data)))
+
+
+def decompress(payload, codec):
+    """
+    解压缩数据，兼容旧版直接传输的压缩字节
+    :param payload: base64字符串或压缩字节
+    :param codec: 压缩编码名称，兼容旧的True值
+    :return: 字节
+    """
+    if isinstance(payload, str):
+        payload = base64.b64decode(payload)
+
+    if codec is True:
+        codec = ZLIB_CODEC
+
+    decompress_func = codecs[codec][1]
+    return decompress_func(payload)
@@ -1,13 +1,21 @@
+import atexit
+import json
+import logging
+import threading
 import time
 
 from nameko.runners import ServiceRunner
 from django.conf import settings
 
 from sv_base.utils.base.func import get_func_key
-from sv_base.utils.base.thread import async_exe
-from sv_base.extensions.service.base import ServiceBase, send_event, event_handler, get_config
+from sv_base.utils.base.text import md5
+from sv_base.utils.base.thread import async_exe, get_timer_queue
+from sv_base.extensions.service.base import (ServiceBase, send_event, send_batch_event, event_handler,
+                                             broadcast_event_handler, get_config)
 from sv_base.extensions.service.rpc import get_context as get_rpc_context
 
+logger = logging.getLogger(__name__)
+
 MESSAGE_CONTEXT_KEY = '_'
 
 get_context = get_rpc_context
@@ -18,85 +26,450 @@ def get_context_key():
     return context.get(MESSAGE_CONTEXT_KEY)
 
 
-def send_message(key, data, timeout=None, **kwargs):
+def send_message(key, data, timeout=None, batch=False, **kwargs):
     """
     发送消息
     :param key: 消息识别key
     :param data: 消息数据
     :param timeout: 消息过期时间
+    :param batch: 是否合并批量发送，适用于高频消息，只支持__context调用参数
+    """
+    if batch:
+        context = kwargs.pop('__context', None)
+        if kwargs:
+            raise ValueError(f'send options not supported with batch: {sorted(kwargs)}')
+
+        send_batch_event(key, data, timeout=timeout, context=context)
+    else:
+        send_event(key, data, timeout=timeout, **kwargs)
+
+
+class MessageCoalescer:
+    """
+    可合并消息的共享发送服务，合并窗口由进程内共享的定时执行队列管理
+
+    合并模式:
+    last: 窗口结束时发送最新一条消息
+    merge: 使用merge_func(旧数据, 新数据)合并消息，窗口结束时发送
+    count: 收集消息列表，达到max_count条或窗口结束时发送
+    """
+    LAST = 'last'
+    MERGE = 'merge'
+    COUNT = 'count'
+
+    class _Stream:
+        def __init__(self):
+            self.data = None
+            self.count = 0
+            self.context = None
+            self.timeout = None
+            self.timer_id = None
+
+    def __init__(self, timer=None):
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._timer = timer or get_timer_queue()
+        self._closed = False
+
+    def send(self, key, data, context_key=None, window=3, timeout=5, mode=LAST, merge_func=None, max_count=None):
+        """
+        添加待合并消息
+        :param key: 消息识别key
+        :param data: 消息数据
+        :param context_key: 消息上下文识别key，默认使用当前上下文的识别key
+        :param window: 合并窗口时间，从窗口内第一条消息开始计算
+        :param timeout: 消息过期时间
+        :param mode: 合并模式
+        :param merge_func: merge模式的合并函数
+        :param max_count: count模式的最大条数
+        :return: 无
+        """
+        if mode == self.MERGE and merge_func is None:
+            raise ValueError('merge mode requires merge_func')
+
+        context = dict(get_context())
+        if context_key is not None:
+            context[MESSAGE_CONTEXT_KEY] = context_key
+        # 按实际发送的上下文识别key合并，不同接收方的消息不合并
+        stream_key = (key, json.dumps(context.get(MESSAGE_CONTEXT_KEY), sort_keys=True, default=str))
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('message coalescer is closed')
+
+            stream = self._streams.get(stream_key)
+            if stream is None:
+                stream = self._streams[stream_key] = self._Stream()
+                stream.timer_id = self._timer.call_later(window, self._expire, (stream_key, stream))
+
+            if mode == self.COUNT:
+                stream.data = (stream.data or []) + [data]
+            elif mode == self.MERGE and stream.count:
+                stream.data = merge_func(stream.data, data)
+            else:
+                stream.data = data
+            stream.count += 1
+            stream.context = context
+            stream.timeout = timeout
+
+            if mode == self.COUNT and max_count and stream.count >= max_count:
+                stream = self._streams.pop(stream_key)
+            else:
+                stream = None
+
+        if stream:
+            self._timer.cancel(stream.timer_id)
+            self._send(key, stream)
+
+    def flush(self):
+        """
+        立即发送所有待合并消息
+        :return: 无
+        """
+        with self._lock:
+            streams = self._streams
+            self._streams = {}
+
+        for (key, _), stream in streams.items():
+            self._timer.cancel(stream.timer_id)
+            self._send(key, stream)
+
+    def close(self):
+        """
+        发送剩余消息并停止
+        :return: 无
+        """
+        with self._lock:
+            self._closed = True
+
+        self.flush()
+
+    def _expire(self, stream_key, stream):
+        with self._lock:
+            # 已提前发送的窗口忽略
+            if self._streams.get(stream_key) is not stream:
+                return
+
+            self._streams.pop(stream_key)
+
+        self._send(stream_key[0], stream)
+
+    def _send(self, key, stream):
+        try:
+            send_message(key, stream.data, timeout=stream.timeout, __context=stream.context)
+        except Exception as e:
+            logger.error('send coalesced message[%s] error: %s', key, e)
+
+
+_message_coalescer = None
+_message_coalescer_lock = threading.Lock()
+
+
+def get_message_coalescer():
+    """
+    获取进程内共享的消息合并发送服务
+    :return: 消息合并发送服务
     """
-    send_event(key, data, timeout=timeout, **kwargs)
+    global _message_coalescer
+    if _message_coalescer is None:
+        with _message_coalescer_lock:
+            if _message_coalescer is None:
+                _message_coalescer = MessageCoalescer()
+                atexit.register(_message_coalescer.close)
+
+    return _message_coalescer
 
 
 class MergeMessageSender:
     """
     发送可合并的发送行为（不重要的数据），延时发送最新一条消息, 减少消息压力，但会降低实时性
     """
-    def __init__(self, key, timeout=5, check_time=3):
+    def __init__(self, key, timeout=5, check_time=3, context_key=None, mode=MessageCoalescer.LAST, merge_func=None,
+                 max_count=None):
         # 必须指定消息路由，只合并同种消息
         self.key = key
         # 准备发送的检测时间
         self.check_time = check_time
-        # 当前是否处于准备发送的检测状态
-        self.checking = False
-
-        self.data = None
         self.timeout = timeout
+        self.context_key = context_key
+        self.mode = mode
+        self.merge_func = merge_func
+        self.max_count = max_count
 
     def send(self, data):
-        # 更新发送的消息为最新
-        self.data = data
+        get_message_coalescer().send(self.key, data, context_key=self.context_key, window=self.check_time,
+                                     timeout=self.timeout, mode=self.mode, merge_func=self.merge_func,
+                                     max_count=self.max_count)
+
+
+class MessageCallbackIndex:
+    """
+    消息回调索引，按消息上下文识别key查找回调，未指定上下文识别key的回调接收所有消息
+    """
 
-        if self.checking:
-            return
+    def __init__(self):
+        self._callbacks = {}
 
-        async_exe(self._send)
+    @staticmethod
+    def _normalize_context_key(context_key):
+        if not context_key:
+            return None
 
-    def _send(self):
-        self.checking = True
-        time.sleep(self.check_time)
-        self.checking = False
-        send_message(self.key, self.data, timeout=self.timeout)
+        # 列表不能作为索引key
+        if isinstance(context_key, list):
+            return tuple(context_key)
 
+        return context_key
 
-def get_message_listener(key, callback, context_key=None, **kwargs):
+    def add(self, callback, context_key=None):
+        self._callbacks.setdefault(self._normalize_context_key(context_key), []).append(callback)
+
+    def remove(self, callback, context_key=None):
+        context_key = self._normalize_context_key(context_key)
+        callbacks = self._callbacks.get(context_key, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                self._callbacks.pop(context_key)
+
+    def match(self, current_context_key):
+        """
+        查找匹配当前上下文识别key的回调
+        :param current_context_key: 当前上下文识别key，可以是列表
+        :return: 回调列表
+        """
+        callbacks = list(self._callbacks.get(None, ()))
+        if current_context_key is None:
+            return callbacks
+
+        if isinstance(current_context_key, (list, tuple)):
+            # 回调的上下文识别key等于整个列表或为其中一项
+            context_keys = dict.fromkeys([tuple(current_context_key)] + list(current_context_key))
+        else:
+            context_keys = (current_context_key,)
+
+        for context_key in context_keys:
+            try:
+                callbacks.extend(self._callbacks.get(context_key, ()))
+            except TypeError:
+                continue
+
+        return callbacks
+
+    def __len__(self):
+        return sum(len(callbacks) for callbacks in self._callbacks.values())
+
+
+def get_message_listeners(key, listeners, group=None, **kwargs):
     """
-    获取消息监听器
+    获取同一消息key的合并监听器，一个消费者按上下文识别key分发到回调
     :param key: 消息识别key
-    :param callback: 回调函数
-    :param context_key: 消息上下文识别key
+    :param listeners: 回调函数和消息上下文识别key列表[(callback, context_key)]
+    :param group: 监听组名称，同一组的进程之间分担消息，不同组各自接收消息
     :return: 消息监听器
     """
+    index = MessageCallbackIndex()
+    for callback, context_key in listeners:
+        index.add(callback, context_key)
+
+    # 服务名称(持久队列名称)只由消息key和监听组决定，增减回调不改变队列
+    service_name = f'message_receiver_{key}_{group}' if group else f'message_receiver_{key}'
+
     class MessageReceiver(ServiceBase):
-        name = f'message_receiver_{key}_{get_func_key(callback)}'
+        name = service_name
 
         @event_handler(key, **kwargs)
         def receive(self, data):
-            if context_key:
-                current_context_key = get_context_key()
-                if (context_key == current_context_key
-                        or (isinstance(current_context_key, (list, tuple)) and context_key in current_context_key)):
+            for callback in index.match(get_context_key()):
+                try:
                     callback(data)
-            else:
-                callback(data)
+                except Exception as e:
+                    logger.error('message[%s] callback[%s] error: %s', key, get_func_key(callback), e)
 
     return MessageReceiver
 
 
-def message_listener(key, context_key=None):
+def get_message_listener(key, callback, context_key=None, **kwargs):
+    """
+    获取消息监听器
+    :param key: 消息识别key
+    :param callback: 回调函数
+    :param context_key: 消息上下文识别key
+    :return: 消息监听器
+    """
+    return get_message_listeners(key, [(callback, context_key)], group=get_func_key(callback), **kwargs)
+
+
+def message_listener(key, context_key=None, group=None):
     """
     消息回调函数装饰器，添加消息识别key
     :param key: 消息识别key
     :param context_key: 消息上下文识别key
+    :param group: 监听组名称，默认为订阅模块名称
     :return: 消息回调函数装饰器
     """
     def _callback(callback):
         callback._message_listener_key = key
         callback._message_listener_context_key = context_key
+        callback._message_listener_group = group
         return callback
     return _callback
 
 
+class MessageSubscription:
+    """
+    消息订阅
+    """
+
+    def __init__(self, hub, consumer_name, callback, context_key=None):
+        self.hub = hub
+        self.consumer_name = consumer_name
+        self.callback = callback
+        self.context_key = context_key
+        self.timer_id = None
+
+    def stop(self):
+        """
+        取消订阅
+        :return: 无
+        """
+        self.hub.unsubscribe(self)
+
+
+class MessageListenerHub:
+    """
+    进程内共享的消息监听中心，所有监听共用一个ServiceRunner，同一消息key只创建一个消费者，在内存中分发到订阅回调
+
+    消费者默认以广播方式接收，每个进程的监听中心都收到全部消息
+    """
+
+    def __init__(self, pool_name=None):
+        self.pool_name = pool_name
+        self._lock = threading.RLock()
+        self._runner = None
+        # 消费者名称: 订阅索引
+        self._subscriptions = {}
+        self._timer = get_timer_queue()
+
+    def subscribe(self, key, callback, context_key=None, timeout=None, **kwargs):
+        """
+        订阅消息
+        :param key: 消息识别key
+        :param callback: 回调函数
+        :param context_key: 消息上下文识别key
+        :param timeout: 超时取消订阅
+        :return: 消息订阅
+        """
+        consumer_name = self._get_consumer_name(key, kwargs)
+        with self._lock:
+            if consumer_name not in self._subscriptions:
+                self._subscriptions[consumer_name] = MessageCallbackIndex()
+                self._start_consumer(consumer_name, key, kwargs)
+
+            subscription = MessageSubscription(self, consumer_name, callback, context_key)
+            self._subscriptions[consumer_name].add(subscription, context_key)
+
+        if timeout:
+            subscription.timer_id = self._timer.call_later(timeout, self.unsubscribe, (subscription,))
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        取消订阅，消费者没有订阅后停止
+        :param subscription: 消息订阅
+        :return: 无
+        """
+        container = None
+        with self._lock:
+            index = self._subscriptions.get(subscription.consumer_name)
+            if index is not None:
+                index.remove(subscription, subscription.context_key)
+                if not len(index):
+                    self._subscriptions.pop(subscription.consumer_name)
+                    if self._runner is not None:
+                        container = self._runner.service_map.pop(subscription.consumer_name, None)
+
+        if subscription.timer_id:
+            self._timer.cancel(subscription.timer_id)
+
+        if container is not None:
+            # 可能在消费者的回调中取消订阅，异步停止避免等待自身
+            async_exe(container.stop)
+
+    def dispatch(self, consumer_name, data):
+        """
+        分发消息到订阅回调
+        :param consumer_name: 消费者名称
+        :param data: 消息数据
+        :return: 无
+        """
+        current_context_key = get_context_key()
+        with self._lock:
+            index = self._subscriptions.get(consumer_name)
+            subscriptions = index.match(current_context_key) if index is not None else []
+
+        for subscription in subscriptions:
+            try:
+                subscription.callback(data)
+            except Exception as e:
+                logger.error('message[%s] callback error: %s', consumer_name, e)
+
+    def stop(self):
+        """
+        停止所有消费者
+        :return: 无
+        """
+        with self._lock:
+            runner = self._runner
+            self._runner = None
+            self._subscriptions = {}
+
+        if runner:
+            runner.stop()
+
+    def _get_consumer_name(self, key, kwargs):
+        options = json.dumps(kwargs, sort_keys=True, default=str)
+        return f'message_hub_{key}_{md5(options)[:8]}'
+
+    def _start_consumer(self, consumer_name, key, kwargs):
+        hub = self
+
+        class MessageHubReceiver(ServiceBase):
+            name = consumer_name
+
+            @broadcast_event_handler(key, **kwargs)
+            def receive(self, data):
+                hub.dispatch(consumer_name, data)
+
+        if self._runner is None:
+            config = get_config(settings.NAMEKO_CONFIG, name=self.pool_name)
+            self._runner = ServiceRunner(config)
+
+        self._runner.add_service(MessageHubReceiver)
+        self._runner.service_map[consumer_name].start()
+
+
+_message_listener_hubs = {}
+_message_listener_hubs_lock = threading.Lock()
+
+
+def get_message_listener_hub(pool_name=None):
+    """
+    获取进程内共享的消息监听中心
+    :param pool_name: 配置池名称
+    :return: 消息监听中心
+    """
+    hub = _message_listener_hubs.get(pool_name)
+    if hub is None:
+        with _message_listener_hubs_lock:
+            hub = _message_listener_hubs.get(pool_name)
+            if hub is None:
+                hub = _message_listener_hubs[pool_name] = MessageListenerHub(pool_name)
+
+    return hub
+
+
 def listen_message(key, callback, context_key=None, timeout=None, block=False, pool_name=None, **kwargs):
     """
     监听消息
@@ -106,21 +479,14 @@ def listen_message(key, callback, context_key=None, timeout=None, block=False, p
     :param timeout: 超时关闭监听
     :param block: 是否阻塞
     :param pool_name: 配置池名称
-    :return: 无
-    """
-    message_listener = get_message_listener(key, callback, context_key, **kwargs)
-    config = get_config(settings.NAMEKO_CONFIG, name=pool_name)
-    service_runner = ServiceRunner(config)
-    service_runner.add_service(message_listener)
-    service_runner.start()
-    if timeout:
-        def stop():
-            time.sleep(timeout)
-            service_runner.stop()
-
-        if block:
-            stop()
-        else:
-            async_exe(stop)
+    :return: 消息订阅，stop()取消监听
+    """
+    hub = get_message_listener_hub(pool_name)
+    if block and timeout:
+        subscription = hub.subscribe(key, callback, context_key=context_key, **kwargs)
+        time.sleep(timeout)
+        subscription.stop()
+    else:
+        subscription = hub.subscribe(key, callback, context_key=context_key, timeout=timeout, **kwargs)
 
-    return service_runner
+    return subscription
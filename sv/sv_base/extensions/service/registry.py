@@ -0,0 +1,71 @@
+"""
+socket代理连接归属登记
+
+记录连接id所在的工作进程，事件按归属进程定向路由，不再广播到所有进程
+"""
+import threading
+import time
+
+from sv_base.utils.base.cache import CacheProduct
+from sv_base.utils.base.text import rk
+
+
+# 当前进程的归属标识，进程启动时生成
+OWNER_ID = rk()
+
+
+def get_owner_routing_key(routing_key, owner_id):
+    """
+    获取定向到归属进程的事件key
+    :param routing_key: 事件key
+    :param owner_id: 归属标识
+    :return: 事件key
+    """
+    return f'{routing_key}.{owner_id}'
+
+
+class LocalConnectionRegistry:
+    """
+    进程内连接归属登记，单进程部署或测试时使用
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self._owners = {}
+
+    def register(self, connection_id, owner_id, timeout=None):
+        expire_at = time.time() + timeout if timeout else None
+        with self._lock:
+            self._owners[connection_id] = (owner_id, expire_at)
+
+    def unregister(self, connection_id):
+        with self._lock:
+            self._owners.pop(connection_id, None)
+
+    def get_owner(self, connection_id):
+        with self._lock:
+            owner_id, expire_at = self._owners.get(connection_id, (None, None))
+            if expire_at and expire_at < time.time():
+                self._owners.pop(connection_id, None)
+                return None
+
+        return owner_id
+
+
+class CacheConnectionRegistry:
+    """
+    缓存连接归属登记，多进程多主机共享
+    """
+
+    def __init__(self, name):
+        self.cache = CacheProduct(f'socket_connection:{name}')
+
+    def register(self, connection_id, owner_id, timeout=None):
+        self.cache.set(connection_id, owner_id, timeout)
+
+    def unregister(self, connection_id):
+        self.cache.delete(connection_id)
+
+    def get_owner(self, connection_id):
+        return self.cache.get(connection_id)
@@ -1,21 +1,30 @@
 import json
 import logging
+import random
+import reprlib
 from threading import local
-import zlib
 import functools
+from django.conf import settings
 from django.utils import translation
 from nameko.constants import LANGUAGE_CONTEXT_KEY
 from nameko.events import event_handler as base_event_handler
 from nameko.rpc import rpc as base_rpc
 from rest_framework import exceptions
 
-from sv_base.utils.base.text import dc, ec
 from sv_base.extensions.db.decorators import promise_db_connection
+from sv_base.extensions.service import codec as rpc_codec
+from sv_base.extensions.service.tracing import get_tracer, SERVER_KIND, SPAN_ID_CONTEXT_KEY
 
 logger = logging.getLogger(__name__)
 
 
 COMPRESS_CONTEXT_KEY = 'compress'
+COMPRESS_ACCEPT_CONTEXT_KEY = 'compress_accept'
+COMPRESSED_RESULT_KEY = '__compressed'
+# 日志中参数和上下文的最大长度
+DEFAULT_LOG_MAX_LENGTH = 500
+
+_log_repr = None
 
 
 class APIException(Exception):
@@ -68,36 +77,146 @@ def get_context():
     return _context.value
 
 
+def _get_log_repr(max_length):
+    log_repr = reprlib.Repr()
+    log_repr.maxlevel = 3
+    log_repr.maxstring = max_length
+    log_repr.maxother = max_length
+    log_repr.maxlong = max_length
+    return log_repr
+
+
+def is_rpc_log_enabled(rpc_logger, service_name, method_name):
+    """
+    是否记录rpc调用日志，先检查日志级别再按采样率抽样
+    :param rpc_logger: 日志对象
+    :param service_name: 服务名称
+    :param method_name: 方法名称
+    :return: bool
+    """
+    if not rpc_logger.isEnabledFor(logging.DEBUG):
+        return False
+
+    # 高频方法可按服务或方法配置采样率 {'service': 0.1, 'service.method': 0.01}
+    sample_rates = getattr(settings, 'RPC_LOG_SAMPLE_RATES', None) or {}
+    sample_rate = sample_rates.get(f'{service_name}.{method_name}',
+                                   sample_rates.get(service_name, getattr(settings, 'RPC_LOG_SAMPLE_RATE', 1)))
+    return sample_rate >= 1 or random.random() < sample_rate
+
+
+def format_log_value(value):
+    """
+    格式化日志数据，截断过长内容
+    :param value: 数据
+    :return: 字符串
+    """
+    max_length = getattr(settings, 'RPC_LOG_MAX_LENGTH', DEFAULT_LOG_MAX_LENGTH)
+    global _log_repr
+    if _log_repr is None or _log_repr.maxstring != max_length:
+        _log_repr = _get_log_repr(max_length)
+
+    text = _log_repr.repr(value)
+    if len(text) > max_length:
+        text = f'{text[:max_length]}...'
+
+    return text
+
+
 def rpc_log(func, self, *args, **kwargs):
-    context = get_context()
-    msg = f'[RPC CALLED] {self.name}:{func.__name__}, args: {args}, kwargs: {kwargs}, context: {context},'
-    logger.debug(msg)
+    if not is_rpc_log_enabled(logger, self.name, func.__name__):
+        return
+
+    logger.debug('[RPC CALLED] %s:%s, args: %s, kwargs: %s, context: %s,', self.name, func.__name__,
+                 format_log_value(args), format_log_value(kwargs), format_log_value(get_context()))
 
 
-def compress_params(args, kwargs):
+def compress_params(args, kwargs, codec=None, threshold=0):
     """
-    压缩参数
+    压缩参数，序列化后小于阈值时不压缩
+    :param args: 参数
+    :param kwargs: 参数
+    :param codec: 压缩编码名称
+    :param threshold: 压缩阈值
+    :return: 使用的压缩编码名称(未压缩为None), args, kwargs
     """
-    param_str = json.dumps({
+    data = rpc_codec.dumps({
         'args': args,
         'kwargs': kwargs,
     })
-    param_str = zlib.compress(ec(param_str))
+    if len(data) < threshold:
+        return None, args, kwargs
 
-    return (param_str,), {}
+    codec = rpc_codec.resolve_codec(codec)
 
+    return codec, (rpc_codec.compress(data, codec),), {}
 
-def decompress_params(args, kwargs):
+
+def decompress_params(args, kwargs, codec=True):
     """
     解压缩参数
     """
-    param_str = args[0]
-    param_str = dc(zlib.decompress(param_str))
-    param = json.loads(param_str)
+    param = rpc_codec.loads(rpc_codec.decompress(args[0], codec))
 
     return param['args'], param['kwargs']
 
 
+def compress_result(result, accept_codecs, threshold=None):
+    """
+    压缩返回值，序列化后小于阈值或无可用编码时不压缩
+    :param result: 返回值
+    :param accept_codecs: 调用方接受的压缩编码名称列表
+    :param threshold: 压缩阈值
+    :return: 返回值
+    """
+    if isinstance(result, RpcResult):
+        result.result = compress_result(result.result, accept_codecs, threshold)
+        return result
+
+    codec = rpc_codec.negotiate_codec(accept_codecs)
+    if not codec:
+        return result
+
+    try:
+        data = rpc_codec.dumps(result)
+    except (TypeError, ValueError):
+        return result
+
+    threshold = rpc_codec.get_compress_threshold() if threshold is None else threshold
+    if len(data) < threshold:
+        return result
+
+    return {
+        COMPRESSED_RESULT_KEY: codec,
+        'data': rpc_codec.compress(data, codec),
+    }
+
+
+def decompress_result(result):
+    """
+    解压缩返回值
+    :param result: 返回值
+    :return: 返回值
+    """
+    if isinstance(result, dict) and COMPRESSED_RESULT_KEY in result:
+        return rpc_codec.loads(rpc_codec.decompress(result['data'], result[COMPRESSED_RESULT_KEY]))
+
+    return result
+
+
+class CompressedRpcReply:
+    """
+    异步调用返回值解压缩代理
+    """
+    def __init__(self, reply):
+        self._reply = reply
+
+    def __getattr__(self, name):
+        return getattr(self._reply, name)
+
+    def result(self):
+        return decompress_result(self._reply.result())
+
+
 def rpc(func):
     """
     添加自定义处理
@@ -106,8 +225,11 @@ def rpc(func):
     @promise_db_connection
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
-        if self.context.pop(COMPRESS_CONTEXT_KEY, False):
-            args, kwargs = decompress_params(args, kwargs)
+        codec = self.context.pop(COMPRESS_CONTEXT_KEY, None)
+        if codec:
+            args, kwargs = decompress_params(args, kwargs, codec)
+
+        accept_codecs = self.context.pop(COMPRESS_ACCEPT_CONTEXT_KEY, None)
 
         # 设置上下文
         if hasattr(self, 'context') and self.context:
@@ -117,15 +239,38 @@ def rpc(func):
         if is_log:
             rpc_log(func, self, *args, **kwargs)
 
+        # 同一上下文中的后续调用(如multi_call中的其他调用)以原调用记录为父记录
+        parent_span_id = self.context.get(SPAN_ID_CONTEXT_KEY)
+        span = get_tracer().start_span(SERVER_KIND, self.name, func.__name__, self.context, args, kwargs)
+
         try:
             ret = func(self, *args, **kwargs)
         except exceptions.APIException as e:
+            if span:
+                span.finish(error=e)
+
             if isinstance(e.detail, (list, dict)):
                 data = e.get_full_details()
             else:
                 data = {'__global': e.get_full_details()}
 
             raise RestException(json.dumps(data))
+        except Exception as e:
+            if span:
+                span.finish(error=e)
+            raise
+        finally:
+            if span:
+                if parent_span_id is None:
+                    self.context.pop(SPAN_ID_CONTEXT_KEY, None)
+                else:
+                    self.context[SPAN_ID_CONTEXT_KEY] = parent_span_id
+
+        if span:
+            span.finish(response=ret.result if isinstance(ret, RpcResult) else ret)
+
+        if accept_codecs:
+            ret = compress_result(ret, accept_codecs)
 
         return ret
 
@@ -0,0 +1,303 @@
+"""
+socket读取多路复用
+
+进程内由一个线程统一等待所有代理socket的可读事件，读取到的数据按连接合并后按顺序交给有限的分发线程处理
+"""
+import collections
+import logging
+import select
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_READ_SIZE = 65536
+DEFAULT_DISPATCH_WORKERS = 8
+# 等待事件的最长时间，同时是超时检查的间隔
+SELECT_TIMEOUT = 1
+
+
+class _Registration:
+    """
+    socket注册信息
+    """
+
+    def __init__(self, callback, close_callback, timeout, read_size, coalesce_size, flush_interval):
+        self.callback = callback
+        self.close_callback = close_callback
+        self.timeout = timeout
+        self.read_size = read_size
+        self.last_active = time.time()
+        # 合并连续读取的数据，达到合并大小或刷新间隔后分发，只在读取线程中访问
+        self.coalesce_size = coalesce_size
+        self.flush_interval = flush_interval
+        self.buffer = bytearray()
+        self.flush_at = None
+        # 待分发的数据，同一连接的数据按顺序分发
+        self.pending = collections.deque()
+        self.dispatching = False
+        self.closed = False
+        # 注册前的socket超时设置，取消注册时恢复
+        self.sock_timeout = None
+
+
+class SocketSelector:
+    """
+    单线程socket读取循环
+    """
+
+    def __init__(self, read_size=DEFAULT_READ_SIZE, dispatch_workers=DEFAULT_DISPATCH_WORKERS):
+        self.read_size = read_size
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._buffer = bytearray(read_size)
+        self._executor = ThreadPoolExecutor(max_workers=dispatch_workers)
+        self._thread = None
+        # 等待刷新合并数据的注册信息
+        self._flushing = set()
+        # 注册变化时唤醒等待中的select
+        self._waker, self._waker_writer = socket.socketpair()
+        self._waker.setblocking(False)
+        self._selector.register(self._waker, selectors.EVENT_READ)
+
+    def register(self, sock, callback, close_callback=None, timeout=None, read_size=None, coalesce_size=None,
+                 flush_interval=None):
+        """
+        注册socket
+        :param sock: socket对象
+        :param callback: 数据回调 callback(data)
+        :param close_callback: 连接关闭、出错或超时的回调 close_callback()
+        :param timeout: 无数据超时时间
+        :param read_size: 单次读取大小
+        :param coalesce_size: 合并数据的最大字节数，None不合并
+        :param flush_interval: 合并数据的最长等待时间
+        :return: 无
+        """
+        read_size = min(read_size or self.read_size, self.read_size)
+        registration = _Registration(callback, close_callback, timeout, read_size, coalesce_size, flush_interval)
+        # 读取循环中使用非阻塞读取，虚假的可读事件不会阻塞所有连接
+        registration.sock_timeout = sock.gettimeout()
+        sock.setblocking(False)
+        with self._lock:
+            self._selector.register(sock, selectors.EVENT_READ, registration)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='socket-selector', daemon=True)
+                self._thread.start()
+
+        self._wake()
+
+    def unregister(self, sock):
+        """
+        取消注册socket，不关闭socket
+        :param sock: socket对象
+        :return: 是否已注册
+        """
+        with self._lock:
+            try:
+                key = self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                return False
+
+        key.data.closed = True
+        try:
+            sock.settimeout(key.data.sock_timeout)
+        except (OSError, AttributeError):
+            pass
+
+        self._wake()
+        return True
+
+    def is_registered(self, sock):
+        with self._lock:
+            try:
+                self._selector.get_key(sock)
+            except (KeyError, ValueError):
+                return False
+
+        return True
+
+    def _wake(self):
+        try:
+            self._waker_writer.send(b'\0')
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            try:
+                events = self._selector.select(self._get_select_timeout())
+            except Exception as e:
+                logger.error('socket selector error: %s', e)
+                time.sleep(SELECT_TIMEOUT)
+                continue
+
+            for key, _ in events:
+                if key.fileobj is self._waker:
+                    self._drain_waker()
+                else:
+                    self._read(key.fileobj, key.data)
+
+            self._check_flush()
+            self._check_timeout()
+
+    def _get_select_timeout(self):
+        if not self._flushing:
+            return SELECT_TIMEOUT
+
+        flush_at = min(registration.flush_at for registration in self._flushing)
+        return max(0, min(SELECT_TIMEOUT, flush_at - time.time()))
+
+    def _drain_waker(self):
+        try:
+            while self._waker.recv(1024):
+                pass
+        except OSError:
+            pass
+
+    def _read(self, sock, registration):
+        view = memoryview(self._buffer)[:registration.read_size]
+        try:
+            if hasattr(sock, 'recv_into'):
+                size = sock.recv_into(view)
+            else:
+                # 只提供recv的类socket对象，如paramiko Channel
+                data = sock.recv(registration.read_size)
+                size = len(data)
+                view[:size] = data
+        except (BlockingIOError, InterruptedError, socket.timeout):
+            return
+        except OSError as e:
+            logger.warning('service daemon socket err: %s', e)
+            self._close(sock, registration)
+            return
+
+        if not size:
+            logger.info('service daemon socket is close')
+            self._close(sock, registration)
+            return
+
+        registration.last_active = time.time()
+        if not registration.coalesce_size:
+            self._dispatch(registration, bytes(view[:size]))
+            return
+
+        registration.buffer.extend(view[:size])
+        if len(registration.buffer) >= registration.coalesce_size or not registration.flush_interval:
+            self._flush(registration)
+        elif registration.flush_at is None:
+            registration.flush_at = registration.last_active + registration.flush_interval
+            self._flushing.add(registration)
+
+    def _flush(self, registration):
+        self._flushing.discard(registration)
+        registration.flush_at = None
+        if registration.buffer and not registration.closed:
+            data = bytes(registration.buffer)
+            registration.buffer.clear()
+            self._dispatch(registration, data)
+
+    def _check_flush(self):
+        now = time.time()
+        for registration in list(self._flushing):
+            if registration.closed or registration.flush_at <= now:
+                self._flush(registration)
+
+    def _check_timeout(self):
+        now = time.time()
+        with self._lock:
+            keys = list(self._selector.get_map().values())
+
+        for key in keys:
+            registration = key.data
+            if registration and registration.timeout and now - registration.last_active > registration.timeout:
+                logger.warning('Receive from service socket timeout.')
+                self._close(key.fileobj, registration)
+
+    def _close(self, sock, registration):
+        # 关闭前分发已合并的数据
+        self._flush(registration)
+        if not self.unregister(sock):
+            return
+
+        if registration.close_callback:
+            self._dispatch(registration, None)
+
+    def _dispatch(self, registration, data):
+        """
+        按连接顺序分发数据，data为None表示连接关闭
+        """
+        with self._lock:
+            registration.pending.append(data)
+            if registration.dispatching:
+                return
+            registration.dispatching = True
+
+        self._executor.submit(self._drain, registration)
+
+    def _drain(self, registration):
+        while True:
+            with self._lock:
+                if not registration.pending:
+                    registration.dispatching = False
+                    return
+                data = registration.pending.popleft()
+
+            try:
+                if data is None:
+                    registration.close_callback()
+                else:
+                    registration.callback(data)
+            except Exception as e:
+                logger.error('socket dispatch error: %s', e)
+
+
+def send_all(sock, data, timeout=None):
+    """
+    发送全部数据，socket注册到读取循环时为非阻塞模式，缓冲区满时等待可写
+    :param sock: socket对象
+    :param data: 数据
+    :param timeout: 发送超时时间
+    :return: 无
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    deadline = time.time() + timeout if timeout else None
+    while data:
+        try:
+            size = sock.send(data)
+        except (BlockingIOError, InterruptedError, socket.timeout):
+            size = 0
+
+        if size:
+            data = data[size:]
+            continue
+
+        wait_time = SELECT_TIMEOUT
+        if deadline is not None:
+            wait_time = min(wait_time, deadline - time.time())
+            if wait_time <= 0:
+                raise socket.timeout('send timeout')
+
+        select.select([], [sock], [], wait_time)
+
+
+_selector = None
+_selector_lock = threading.Lock()
+
+
+def get_socket_selector():
+    """
+    获取进程内共享的socket读取循环
+    :return: socket读取循环
+    """
+    global _selector
+    if _selector is None:
+        with _selector_lock:
+            if _selector is None:
+                _selector = SocketSelector()
+
+    return _selector
@@ -0,0 +1,325 @@
+"""
+rpc调用追踪
+
+调用链的trace_id/span_id随上下文传递，按服务和方法统计客户端、服务端耗时分布和数据大小，完成的调用记录交给导出器
+"""
+import bisect
+import collections
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+TRACE_ID_CONTEXT_KEY = 'trace_id'
+SPAN_ID_CONTEXT_KEY = 'span_id'
+
+CLIENT_KIND = 'client'
+SERVER_KIND = 'server'
+
+# 耗时分布区间上限(毫秒)
+DEFAULT_LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def new_span_id():
+    return uuid.uuid4().hex[:16]
+
+
+def get_payload_size(value):
+    """
+    获取数据json序列化后的大小
+    :param value: 数据
+    :return: 字节数，无法序列化为None
+    """
+    try:
+        return len(json.dumps(value, cls=DjangoJSONEncoder))
+    except (TypeError, ValueError):
+        return None
+
+
+class Histogram:
+    """
+    耗时分布统计，线程安全
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0
+        self._max = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    def quantile(self, q):
+        """
+        估算分位值，返回所在区间上限
+        :param q: 分位 0-1
+        :return: 分位值
+        """
+        with self._lock:
+            counts, count, max_value = list(self._counts), self._count, self._max
+
+        if not count:
+            return 0
+
+        rank = q * count
+        total = 0
+        for index, bucket_count in enumerate(counts):
+            total += bucket_count
+            if total >= rank:
+                return self.buckets[index] if index < len(self.buckets) else max_value
+
+        return max_value
+
+    def data(self):
+        with self._lock:
+            counts, count, total, max_value = list(self._counts), self._count, self._sum, self._max
+
+        return {
+            'count': count,
+            'sum': total,
+            'avg': total / count if count else 0,
+            'max': max_value,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'], counts)),
+        }
+
+
+class SpanExporter:
+    """
+    调用记录导出器接口
+    """
+
+    def export(self, span):
+        """
+        导出完成的调用记录
+        :param span: 调用记录
+        :return: 无
+        """
+        raise NotImplementedError()
+
+
+class InMemorySpanExporter(SpanExporter):
+    """
+    内存调用记录导出器，保留最近的调用记录，用于测试和调试
+    """
+
+    def __init__(self, max_spans=10000):
+        self._lock = threading.Lock()
+        self._spans = collections.deque(maxlen=max_spans)
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def get_spans(self, trace_id=None):
+        with self._lock:
+            spans = list(self._spans)
+
+        if trace_id:
+            spans = [span for span in spans if span['trace_id'] == trace_id]
+
+        return spans
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class Span:
+    """
+    一次rpc调用记录
+    """
+
+    def __init__(self, tracer, kind, service, method, trace_id, parent_id=None):
+        self.tracer = tracer
+        self.kind = kind
+        self.service = service
+        self.method = method
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.request_size = None
+        self.response_size = None
+        self.error = None
+        self.finished = False
+
+    def finish(self, error=None, response=None):
+        """
+        结束调用记录
+        :param error: 调用异常
+        :param response: 返回数据，统计大小时使用
+        :return: 无
+        """
+        if self.finished:
+            return
+
+        self.finished = True
+        self.error = repr(error) if error else None
+        if response is not None and self.tracer.measure_payload:
+            self.response_size = get_payload_size(response)
+        self.tracer.record(self, (time.perf_counter() - self._start) * 1000)
+
+    def data(self, duration):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'kind': self.kind,
+            'service': self.service,
+            'method': self.method,
+            'start_time': self.start_time,
+            'duration': duration,
+            'request_size': self.request_size,
+            'response_size': self.response_size,
+            'error': self.error,
+        }
+
+
+class RpcTracer:
+    """
+    rpc调用追踪器
+    """
+
+    def __init__(self, enabled=True, measure_payload=False, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.enabled = enabled
+        # 统计数据大小需额外序列化一次
+        self.measure_payload = measure_payload
+        self.buckets = buckets
+        self.exporters = []
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._payloads = {}
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        if exporter in self.exporters:
+            self.exporters.remove(exporter)
+
+    def start_span(self, kind, service, method, context, args=None, kwargs=None):
+        """
+        开始调用记录，把调用链标识写入上下文
+        :param kind: 客户端或服务端
+        :param service: 服务名称
+        :param method: 方法名称
+        :param context: 调用上下文
+        :param args: 调用参数
+        :param kwargs: 调用参数
+        :return: 调用记录，未启用时为None
+        """
+        if not self.enabled:
+            return None
+
+        trace_id = context.get(TRACE_ID_CONTEXT_KEY) or new_trace_id()
+        span = Span(self, kind, service, method, trace_id, context.get(SPAN_ID_CONTEXT_KEY))
+        context[TRACE_ID_CONTEXT_KEY] = trace_id
+        context[SPAN_ID_CONTEXT_KEY] = span.span_id
+        if self.measure_payload:
+            span.request_size = get_payload_size([args or (), kwargs or {}])
+
+        return span
+
+    def record(self, span, duration):
+        key = (span.kind, span.service, span.method)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.buckets))
+        histogram.observe(duration)
+
+        if span.request_size is not None or span.response_size is not None:
+            with self._lock:
+                payload = self._payloads.setdefault(key, {'request_bytes': 0, 'response_bytes': 0})
+                payload['request_bytes'] += span.request_size or 0
+                payload['response_bytes'] += span.response_size or 0
+
+        if self.exporters:
+            data = span.data(duration)
+            for exporter in self.exporters:
+                exporter.export(data)
+
+    def metrics(self):
+        """
+        获取统计数据
+        :return: {kind: {service.method: 统计}}
+        """
+        with self._lock:
+            histograms = dict(self._histograms)
+            payloads = {key: dict(value) for key, value in self._payloads.items()}
+
+        metrics = {}
+        for (kind, service, method), histogram in histograms.items():
+            data = histogram.data()
+            data.update(payloads.get((kind, service, method), {}))
+            metrics.setdefault(kind, {})[f'{service}.{method}'] = data
+
+        return metrics
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._payloads = {}
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """
+    获取进程内共享的追踪器
+    :return: 追踪器
+    """
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = RpcTracer(
+                    enabled=getattr(settings, 'RPC_TRACING', True),
+                    measure_payload=getattr(settings, 'RPC_TRACE_PAYLOAD_SIZE', False),
+                )
+
+    return _tracer
+
+
+class TracedRpcReply:
+    """
+    异步调用结果代理，获取结果时结束调用记录
+    """
+
+    def __init__(self, reply, span):
+        self._reply = reply
+        self._span = span
+
+    def __getattr__(self, name):
+        return getattr(self._reply, name)
+
+    def result(self):
+        try:
+            ret = self._reply.result()
+        except Exception as e:
+            self._span.finish(error=e)
+            raise
+
+        self._span.finish(response=ret)
+        return ret
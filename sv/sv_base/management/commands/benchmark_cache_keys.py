@@ -0,0 +1,67 @@
+import inspect
+import json
+import timeit
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.http import QueryDict
+
+from sv_base.extensions.rest.mixins import _generate_cache_key
+from sv_base.utils.base.cache import default_key_func
+from sv_base.utils.base.text import md5
+
+
+def legacy_key_func(method, *args, **kwargs):
+    """
+    原先的方法缓存key，每次调用getcallargs并md5
+    """
+    arg_dict = inspect.getcallargs(method, *args, **kwargs)
+    arg_dict.update({
+        '__qualname__': method.__qualname__,
+        '__module__': method.__module__,
+    })
+
+    arg_dict.pop('self', None)
+    arg_dict.pop('cls', None)
+
+    return md5(json.dumps(arg_dict, sort_keys=True).encode('utf-8'))
+
+
+def sample_func(pk, model=None, fields=None, with_deleted=False):
+    pass
+
+
+def get_list_view(cache_key_params):
+    """
+    模拟列表请求的viewset
+    """
+    return SimpleNamespace(
+        request=SimpleNamespace(query_params=QueryDict('search=name&status=1&ordering=-id&offset=40&limit=20')),
+        paginator=SimpleNamespace(limit_query_param='limit', offset_query_param='offset', offset=40, limit=20),
+        kwargs={},
+        query_data_fields=['id', 'username'],
+        cache_key_params=cache_key_params,
+        get_cache_key_prefix=lambda: None,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Compare the cost of legacy and current cache key builders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        number = options['number']
+        queryset = get_user_model().objects.filter(username__contains='name', status=1).order_by('-id')[40:60]
+
+        cases = [
+            ('func_cache legacy', lambda: legacy_key_func(sample_func, 1, model='user', fields=['id'])),
+            ('func_cache current', lambda: default_key_func(sample_func, 1, model='user', fields=['id'])),
+            ('list sql', lambda: _generate_cache_key(get_list_view(None), queryset)),
+            ('list params', lambda: _generate_cache_key(get_list_view(True), queryset)),
+        ]
+        for name, func in cases:
+            cost = timeit.timeit(func, number=number)
+            self.stdout.write(f'{name:>20} {cost / number * 1e6:>10.2f} us')
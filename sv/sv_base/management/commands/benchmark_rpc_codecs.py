@@ -0,0 +1,46 @@
+import timeit
+
+from django.core.management import BaseCommand
+
+from sv_base.extensions.service import codec as rpc_codec
+from sv_base.utils.base.text import rk
+
+
+def get_batch_get_payload(rows):
+    """
+    模拟batch_get返回的序列化数据
+    :param rows: 数据条数
+    :return: 数据列表
+    """
+    return [{
+        'id': i,
+        'resource_id': rk(),
+        'name': f'name_{i}',
+        'status': i % 3,
+        'description': '这是一段描述 description text ' * 4,
+        'create_time': '2019-05-01 12:00:00',
+        'modify_time': '2019-05-02 12:00:00',
+        'tags': [f'tag_{i % 5}', f'tag_{i % 7}'],
+    } for i in range(rows)]
+
+
+class Command(BaseCommand):
+    help = 'Compare rpc payload codecs on representative batch_get payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1, 10, 100, 1000])
+        parser.add_argument('--number', type=int, default=100)
+
+    def handle(self, *args, **options):
+        number = options['number']
+        self.stdout.write(f'{"rows":>6} {"codec":>6} {"raw":>9} {"packed":>9} {"ratio":>6} '
+                          f'{"compress(us)":>13} {"decompress(us)":>15}')
+        for rows in options['rows']:
+            data = rpc_codec.dumps(get_batch_get_payload(rows))
+            for codec in rpc_codec.get_codec_names():
+                payload = rpc_codec.compress(data, codec)
+                compress_time = timeit.timeit(lambda: rpc_codec.compress(data, codec), number=number)
+                decompress_time = timeit.timeit(lambda: rpc_codec.decompress(payload, codec), number=number)
+                self.stdout.write(f'{rows:>6} {codec:>6} {len(data):>9} {len(payload):>9} '
+                                  f'{len(payload) / len(data):>6.2f} '
+                                  f'{compress_time / number * 1e6:>13.1f} {decompress_time / number * 1e6:>15.1f}')
@@ -0,0 +1,58 @@
+import logging
+import timeit
+
+from django.core.management import BaseCommand
+
+from sv_base.extensions.service import rpc as rpc_module
+from sv_base.management.commands.benchmark_rpc_codecs import get_batch_get_payload
+
+
+class _Service:
+    name = 'benchmark_service'
+
+
+def _method(self, *args, **kwargs):
+    pass
+
+
+def eager_rpc_log(func, self, *args, **kwargs):
+    """
+    原先的日志方式，总是格式化全部参数
+    """
+    context = rpc_module.get_context()
+    msg = f'[RPC CALLED] {self.name}:{func.__name__}, args: {args}, kwargs: {kwargs}, context: {context},'
+    rpc_module.logger.debug(msg)
+
+
+class Command(BaseCommand):
+    help = 'Measure per-call overhead of rpc logging with DEBUG off and on'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100)
+        parser.add_argument('--number', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        number = options['number']
+        service = _Service()
+        payload = get_batch_get_payload(options['rows'])
+        rpc_logger = rpc_module.logger
+        origin_level = rpc_logger.level
+        origin_propagate = rpc_logger.propagate
+        handler = logging.NullHandler()
+        rpc_logger.addHandler(handler)
+        rpc_logger.propagate = False
+
+        self.stdout.write(f'{"level":>6} {"eager(us)":>10} {"lazy(us)":>10}')
+        try:
+            for level in (logging.INFO, logging.DEBUG):
+                rpc_logger.setLevel(level)
+                eager_time = timeit.timeit(lambda: eager_rpc_log(_method, service, payload, fields=['id']),
+                                           number=number)
+                lazy_time = timeit.timeit(lambda: rpc_module.rpc_log(_method, service, payload, fields=['id']),
+                                          number=number)
+                self.stdout.write(f'{logging.getLevelName(level):>6} {eager_time / number * 1e6:>10.2f} '
+                                  f'{lazy_time / number * 1e6:>10.2f}')
+        finally:
+            rpc_logger.removeHandler(handler)
+            rpc_logger.setLevel(origin_level)
+            rpc_logger.propagate = origin_propagate
@@ -0,0 +1,52 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from sv_base.extensions.db import keyset
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        model = get_user_model()
+        base_time = timezone.now().replace(microsecond=100)
+        cls.users = [
+            model.objects.create(username=f'keyset_{i}', date_joined=base_time + datetime.timedelta(microseconds=i),
+                                 last_login=None if i % 2 else base_time)
+            for i in range(5)
+        ]
+
+    def _get_all_pages(self, queryset, ordering, page_size):
+        rows = []
+        cursor = None
+        for _ in range(len(self.users) + 1):
+            page, cursor, _ = keyset.paginate_keyset(queryset, ordering, page_size, cursor=cursor)
+            rows.extend(page)
+            if not cursor:
+                break
+
+        return rows
+
+    def test_cursor_keeps_microseconds(self):
+        values = [self.users[0].date_joined]
+        decoded, reverse = keyset.decode_cursor(keyset.encode_cursor(values))
+        self.assertEqual(decoded, values)
+        self.assertFalse(reverse)
+
+    def test_page_microsecond_apart_rows(self):
+        queryset = get_user_model().objects.filter(username__startswith='keyset_')
+        for field in ('date_joined', '-date_joined'):
+            ordering = keyset.get_keyset_ordering(queryset, field)
+            expected = list(queryset.order_by(*ordering))
+            for page_size in (1, 2):
+                self.assertEqual(self._get_all_pages(queryset, ordering, page_size), expected)
+
+    def test_page_nullable_field(self):
+        queryset = get_user_model().objects.filter(username__startswith='keyset_')
+        for field in ('last_login', '-last_login'):
+            ordering = keyset.get_keyset_ordering(queryset, field)
+            expected = list(queryset.order_by(*ordering))
+            self.assertEqual(self._get_all_pages(queryset, ordering, 2), expected)
@@ -1,30 +1,346 @@
+import collections
 import functools
 import inspect
 import json
 import logging
+import pickle
+import random
+import threading
+import time
 import types
 
 from django.core.cache import _create_cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.conf import settings
 
-from sv_base.utils.base.text import md5
+from sv_base.utils.base.text import md5, fast_hash
 
 logger = logging.getLogger(__name__)
 
 
+class CacheStats:
+    """
+    缓存命中统计，线程安全的进程内计数
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self, count=1):
+        with self._lock:
+            self.hits += count
+
+    def miss(self, count=1):
+        with self._lock:
+            self.misses += count
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def data(self):
+        """获取统计数据
+
+        :return: 命中数、未命中数、命中率
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0,
+        }
+
+
+# 命名空间代数在进程内的缓存时间(秒)
+GENERATION_LOCAL_AGE = 0.005
+GENERATION_KEY_PREFIX = 'cache_generation'
+
+# 进程内缓存默认条数和存活时间(秒)
+DEFAULT_LOCAL_CACHE_SIZE = 1024
+DEFAULT_LOCAL_CACHE_TTL = 1
+
+_MISSING = object()
+
+_generations = {}
+_generation_cache = None
+_generation_cache_classes = {}
+
+
+def _get_generation_cache():
+    global _generation_cache
+    if _generation_cache is None:
+        _generation_cache = _create_cache('default')
+
+    return _generation_cache
+
+
+def get_generation(namespace):
+    """获取缓存命名空间的当前代数，进程内缓存GENERATION_LOCAL_AGE秒
+
+    :param namespace: 命名空间
+    :return: 代数
+    """
+    now = time.monotonic()
+    cached = _generations.get(namespace)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    cache_instance = _get_generation_cache()
+    key = f'{GENERATION_KEY_PREFIX}:{namespace}'
+    generation = cache_instance.get(key)
+    if generation is None:
+        # 使用时间戳作为初始代数，避免与丢失前的代数重复
+        cache_instance.add(key, int(time.time() * 1000000), None)
+        generation = cache_instance.get(key) or 0
+
+    _generations[namespace] = (generation, now + GENERATION_LOCAL_AGE)
+    return generation
+
+
+def incr_generation(namespace):
+    """增加缓存命名空间的代数，旧代数的缓存数据不再被访问，到期自动清除
+
+    :param namespace: 命名空间
+    """
+    cache_instance = _get_generation_cache()
+    key = f'{GENERATION_KEY_PREFIX}:{namespace}'
+    try:
+        cache_instance.incr(key)
+    except ValueError:
+        cache_instance.set(key, int(time.time() * 1000000), None)
+
+    _generations.pop(namespace, None)
+
+
+class LocalCache:
+    """
+    进程内LRU缓存，限制条数和存活时间，保存序列化数据避免调用方修改共享对象
+    """
+
+    def __init__(self, max_size=DEFAULT_LOCAL_CACHE_SIZE, ttl=DEFAULT_LOCAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()
+
+    def get(self, key):
+        """获取缓存
+
+        :param key: 缓存key
+        :return: 是否命中, 缓存数据
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._data.move_to_end(key)
+                else:
+                    del self._data[key]
+                    item = None
+
+        if item is None:
+            self.stats.miss()
+            return False, None
+
+        self.stats.hit()
+        return True, pickle.loads(item[0])
+
+    def set(self, key, value, timeout=None):
+        ttl = self.ttl if timeout is None else min(self.ttl, timeout)
+        if ttl <= 0:
+            self.delete(key)
+            return
+
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (data, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_caches = {}
+_local_caches_lock = threading.Lock()
+
+
+def get_local_cache(name, config=None):
+    """获取缓存命名空间的进程内缓存
+
+    :param name: 缓存名称
+    :param config: 进程内缓存配置 True或{'max_size': 条数, 'ttl': 秒}，None使用LOCAL_CACHES配置
+    :return: 进程内缓存，未启用为None
+    """
+    if config is None:
+        config = getattr(settings, 'LOCAL_CACHES', {}).get(name)
+
+    if not config:
+        return None
+
+    local_cache = _local_caches.get(name)
+    if local_cache is None:
+        with _local_caches_lock:
+            local_cache = _local_caches.get(name)
+            if local_cache is None:
+                local_cache = LocalCache(**config) if isinstance(config, dict) else LocalCache()
+                _local_caches[name] = local_cache
+
+    return local_cache
+
+
+def get_local_cache_stats():
+    """获取所有进程内缓存的命中统计
+
+    :return: {缓存名称: 统计数据}
+    """
+    return {name: local_cache.stats.data() for name, local_cache in list(_local_caches.items())}
+
+
+def _get_generation_cache_class(cache_cls):
+    generation_cache_cls = _generation_cache_classes.get(cache_cls)
+    if generation_cache_cls is None:
+        class GenerationCache(cache_cls):
+            """
+            缓存版本由命名空间和当前代数组成
+
+            启用进程内缓存时读取先查进程内缓存，key包含代数，重置后自动失效；
+            其他进程对同一key的修改在进程内缓存存活时间后可见
+            """
+            local_cache = None
+
+            @property
+            def version(self):
+                return f'{self.namespace}:{get_generation(self.namespace)}'
+
+            @version.setter
+            def version(self, value):
+                pass
+
+            def get(self, key, default=None, version=None, **kwargs):
+                if self.local_cache is None:
+                    return super().get(key, default, version, **kwargs)
+
+                local_key = self.make_key(key, version)
+                hit, value = self.local_cache.get(local_key)
+                if hit:
+                    return value
+
+                value = super().get(key, _MISSING, version, **kwargs)
+                if value is _MISSING:
+                    return default
+
+                self.local_cache.set(local_key, value)
+                return value
+
+            def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+                result = super().set(key, value, timeout, version, **kwargs)
+                if self.local_cache is not None:
+                    local_timeout = None if timeout is DEFAULT_TIMEOUT else timeout
+                    self.local_cache.set(self.make_key(key, version), value, local_timeout)
+
+                return result
+
+            def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+                if self.local_cache is not None:
+                    self.local_cache.delete(self.make_key(key, version))
+
+                return super().add(key, value, timeout, version, **kwargs)
+
+            def delete(self, key, version=None, **kwargs):
+                if self.local_cache is not None:
+                    self.local_cache.delete(self.make_key(key, version))
+
+                return super().delete(key, version, **kwargs)
+
+            def get_many(self, keys, version=None, **kwargs):
+                if self.local_cache is None:
+                    return super().get_many(keys, version, **kwargs)
+
+                values = {}
+                missing_keys = []
+                for key in keys:
+                    hit, value = self.local_cache.get(self.make_key(key, version))
+                    if hit:
+                        values[key] = value
+                    else:
+                        missing_keys.append(key)
+
+                if missing_keys:
+                    missing_values = super().get_many(missing_keys, version, **kwargs)
+                    for key, value in missing_values.items():
+                        self.local_cache.set(self.make_key(key, version), value)
+                    values.update(missing_values)
+
+                return values
+
+            def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+                result = super().set_many(data, timeout, version, **kwargs)
+                if self.local_cache is not None:
+                    local_timeout = None if timeout is DEFAULT_TIMEOUT else timeout
+                    for key, value in data.items():
+                        self.local_cache.set(self.make_key(key, version), value, local_timeout)
+
+                return result
+
+            def delete_many(self, keys, version=None, **kwargs):
+                if self.local_cache is not None:
+                    keys = list(keys)
+                    for key in keys:
+                        self.local_cache.delete(self.make_key(key, version))
+
+                return super().delete_many(keys, version, **kwargs)
+
+            def has_key(self, key, version=None, **kwargs):
+                if self.local_cache is None:
+                    return super().has_key(key, version, **kwargs)
+
+                # 不读进程内缓存，用于检查其他进程持有的锁等短期数据
+                return super().get(key, _MISSING, version, **kwargs) is not _MISSING
+
+            def incr(self, key, delta=1, version=None, **kwargs):
+                if self.local_cache is not None:
+                    self.local_cache.delete(self.make_key(key, version))
+
+                return super().incr(key, delta, version, **kwargs)
+
+        generation_cache_cls = _generation_cache_classes[cache_cls] = GenerationCache
+
+    return generation_cache_cls
+
+
 class CacheProduct:
     """
     memcached引擎缓存类
     """
 
-    def __new__(cls, name):
+    def __new__(cls, name, local_cache=None):
+        """
+        :param name: 缓存名称
+        :param local_cache: 进程内缓存配置，None使用LOCAL_CACHES配置
+        """
         # 创建一个新的缓存实例
         cache_instance = _create_cache('default')
 
-        # 根据缓存实例名称生成该缓存的版本号键
-        version = cls.get_version(name)
-        cache_instance.version = version
-        setattr(cache_instance, 'reset', types.MethodType(delete_cache, cache_instance))
+        # 根据缓存实例名称生成该缓存的命名空间，版本号随代数变化
+        cache_instance.__class__ = _get_generation_cache_class(type(cache_instance))
+        cache_instance.namespace = cls.get_version(name)
+        cache_instance.local_cache = get_local_cache(name, local_cache)
+        setattr(cache_instance, 'reset', types.MethodType(reset_cache, cache_instance))
         return cache_instance
 
     # 生成版本号
@@ -33,6 +349,17 @@ class CacheProduct:
         return md5('%s:cache' % name)
 
 
+def reset_cache(cache_instance):
+    """重置该缓存，O(1)增加命名空间代数
+
+    :param cache_instance: 缓存实例
+    """
+    try:
+        incr_generation(cache_instance.namespace)
+    except Exception as e:
+        logger.error('reset cache error: %s', e)
+
+
 def delete_cache(cache_instance):
     """删除该缓存
 
@@ -44,26 +371,279 @@ def delete_cache(cache_instance):
         logger.error('delete cache error: %s', e)
 
 
-def default_key_func(method, *args, **kwargs):
-    arg_dict = inspect.getcallargs(method, *args, **kwargs)
-    arg_dict.update({
-        '__qualname__': method.__qualname__,
-        '__module__': method.__module__,
-    })
+# 缓存标签版本的缓存名称和有效期，标签过期后视为已变化
+TAG_CACHE_NAME = 'cache_tags'
+TAG_VERSION_AGE = 24 * 3600
+
+_tag_cache = None
+
+
+def _get_tag_cache():
+    global _tag_cache
+    if _tag_cache is None:
+        _tag_cache = CacheProduct(TAG_CACHE_NAME)
+
+    return _tag_cache
+
+
+def get_tag_versions(tags):
+    """获取缓存标签的当前版本
+
+    :param tags: 标签列表
+    :return: {标签: 版本}
+    """
+    tags = list(tags)
+    versions = _get_tag_cache().get_many(tags) if tags else {}
+    return {tag: versions.get(tag) for tag in tags}
+
+
+def check_tag_versions(versions):
+    """检查缓存标签版本是否未变化
+
+    :param versions: 缓存数据记录的{标签: 版本}
+    :return: bool
+    """
+    return get_tag_versions(versions) == versions
+
+
+def invalidate_tags(tags):
+    """失效缓存标签，依赖这些标签的缓存数据不再有效
+
+    :param tags: 标签列表
+    """
+    cache_instance = _get_tag_cache()
+    for tag in set(tags):
+        try:
+            cache_instance.incr(tag)
+        except ValueError:
+            # 标签不存在时使用时间戳作为初始版本，避免与过期前的版本重复
+            cache_instance.set(tag, int(time.time() * 1000000), TAG_VERSION_AGE)
+        except Exception as e:
+            logger.error('invalidate cache tag[%s] error: %s', tag, e)
 
-    arg_dict.pop('self', None)
-    arg_dict.pop('cls', None)
 
-    return md5(json.dumps(arg_dict, sort_keys=True).encode('utf-8'))
+# 缓存过期时间随机缩短的比例，避免同时过期
+DEFAULT_TTL_JITTER = 0.1
+# 重新计算缓存的锁过期时间，也是等待其他计算结果的最长时间
+DEFAULT_LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
 
 
-def func_cache(cache=None, key_func=None, key_prefix=None, expires=settings.DEFAULT_CACHE_AGE):
+class CacheEntry:
     """
-    方法的cache
+    带新鲜期限的缓存数据，超过期限后在stale期内仍可返回旧数据
+    """
+
+    def __init__(self, value, fresh_until):
+        self.value = value
+        self.fresh_until = fresh_until
+
+
+class _Flight:
+    """
+    进程内正在进行的缓存计算
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def jitter_timeout(timeout, jitter=DEFAULT_TTL_JITTER):
+    """随机缩短过期时间
+
+    :param timeout: 过期时间
+    :param jitter: 缩短比例上限
+    :return: 过期时间
+    """
+    if not timeout or not jitter:
+        return timeout
+
+    return timeout * (1 - random.random() * jitter)
+
+
+def _read_entry(cache_instance, key, validate):
+    value = cache_instance.get(key)
+    if value is None:
+        return _MISSING, False
+
+    if isinstance(value, CacheEntry):
+        fresh = value.fresh_until is None or value.fresh_until > time.time()
+        value = value.value
+    else:
+        # 旧格式数据视为新鲜
+        fresh = True
+
+    if validate and not validate(value):
+        return _MISSING, False
+
+    return value, fresh
+
+
+def _write_entry(cache_instance, key, value, timeout, stale_age, jitter):
+    timeout = jitter_timeout(timeout, jitter)
+    if timeout is None:
+        cache_instance.set(key, CacheEntry(value, None), None)
+    else:
+        cache_instance.set(key, CacheEntry(value, time.time() + timeout), timeout + (stale_age or 0))
+
+
+def _compute_entry(cache_instance, key, compute, timeout, stale_age, jitter, cache_none):
+    value = compute()
+    if value is not None or cache_none:
+        _write_entry(cache_instance, key, value, timeout, stale_age, jitter)
+
+    return value
+
+
+def _wait_entry(cache_instance, key, lock_key, validate, wait_timeout):
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value, _ = _read_entry(cache_instance, key, validate)
+        if value is not _MISSING:
+            return value
+
+        # 锁已释放但没有写入数据(计算异常或结果为空)，不再等待
+        if not cache_instance.has_key(lock_key):
+            break
+
+    return _MISSING
+
+
+def get_or_set_cache(cache_instance, key, compute, timeout=settings.DEFAULT_CACHE_AGE, stale_age=0,
+                     jitter=DEFAULT_TTL_JITTER, validate=None, cache_none=False, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+    """获取缓存，不存在时只由一个调用方计算
+
+    进程内同一key的并发调用等待正在进行的计算结果；跨进程使用缓存锁，未获得锁时返回过期的旧数据，
+    没有旧数据时等待锁持有方写入缓存，锁释放后仍无数据或超时则自行计算
+
+    :param cache_instance: 缓存实例
+    :param key: 缓存key
+    :param compute: 计算缓存数据的方法
+    :param timeout: 缓存新鲜时间，单位秒
+    :param stale_age: 过期后仍可返回旧数据的时间，单位秒
+    :param jitter: 新鲜时间随机缩短的比例上限
+    :param validate: 检查缓存数据是否有效的方法，无效数据不作为旧数据返回
+    :param cache_none: 是否缓存None结果
+    :param lock_timeout: 缓存锁过期时间
+    :return: 缓存数据
+    """
+    value, fresh = _read_entry(cache_instance, key, validate)
+    if fresh:
+        return value
+
+    stale = value
+    flight_key = cache_instance.make_key(key)
+    with _flights_lock:
+        flight = _flights.get(flight_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[flight_key] = _Flight()
+
+    if not leader:
+        if stale is not _MISSING:
+            return stale
+
+        if flight.event.wait(lock_timeout) and flight.error is None:
+            return flight.value
+
+        return compute()
+
+    try:
+        lock_key = f'{key}:lock'
+        if cache_instance.add(lock_key, 1, lock_timeout):
+            try:
+                value = _compute_entry(cache_instance, key, compute, timeout, stale_age, jitter, cache_none)
+            finally:
+                cache_instance.delete(lock_key)
+        elif stale is not _MISSING:
+            value = stale
+        else:
+            value = _wait_entry(cache_instance, key, lock_key, validate, lock_timeout)
+            if value is _MISSING:
+                value = _compute_entry(cache_instance, key, compute, timeout, stale_age, jitter, cache_none)
+
+        flight.value = value
+        return value
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(flight_key, None)
+        flight.event.set()
+
+
+class _CallSignature:
+    """
+    方法的参数信息，只有普通位置参数的方法直接按位置取值，其他情况使用inspect绑定参数
+    """
+
+    def __init__(self, method):
+        self.signature = inspect.signature(method)
+        self.prefix = f'{method.__module__}.{method.__qualname__}'
+        parameters = list(self.signature.parameters.values())
+        self.simple = all(parameter.kind == parameter.POSITIONAL_OR_KEYWORD for parameter in parameters)
+        self.names = [parameter.name for parameter in parameters]
+        self.defaults = [parameter.default for parameter in parameters]
+        self.skip_first = bool(self.names) and self.names[0] in ('self', 'cls')
+
+    def get_arguments(self, args, kwargs):
+        """获取按参数顺序排列的参数值，不含self、cls
+
+        :param args: 位置参数
+        :param kwargs: 关键字参数
+        :return: [(参数名, 参数值)]
+        """
+        if self.simple and len(args) <= len(self.names) and kwargs.keys() <= set(self.names[len(args):]):
+            arguments = list(zip(self.names, args))
+            for name, default in zip(self.names[len(args):], self.defaults[len(args):]):
+                value = kwargs.get(name, default)
+                if value is inspect.Parameter.empty:
+                    break
+                arguments.append((name, value))
+            else:
+                return arguments[1:] if self.skip_first else arguments
+
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = list(bound.arguments.items())
+        return arguments[1:] if self.skip_first else arguments
+
+
+_call_signatures = {}
+
+
+def _get_call_signature(method):
+    call_signature = _call_signatures.get(method)
+    if call_signature is None:
+        call_signature = _call_signatures[method] = _CallSignature(method)
+
+    return call_signature
+
+
+def default_key_func(method, *args, **kwargs):
+    call_signature = _get_call_signature(method)
+    arguments = call_signature.get_arguments(args, kwargs)
+    return fast_hash(f'{call_signature.prefix}:{json.dumps(arguments, sort_keys=True)}')
+
+
+def func_cache(cache=None, key_func=None, key_prefix=None, expires=settings.DEFAULT_CACHE_AGE, stale_age=0,
+               jitter=DEFAULT_TTL_JITTER):
+    """
+    方法的cache，并发未命中时只计算一次
     :param cache: 缓存操作实例
     :param key_func: 生成cache_key的方法
     :param key_prefix: 缓存的key前缀
     :param expires: 缓存过期时间，单位秒
+    :param stale_age: 过期后仍可返回旧数据的时间，单位秒
+    :param jitter: 过期时间随机缩短的比例上限
     :return:
     """
 
@@ -87,15 +667,8 @@ def func_cache(cache=None, key_func=None, key_prefix=None, expires=settings.DEFA
             else:
                 cache_instance = cache or CacheProduct('default_func_cache')
 
-            cache_data = cache_instance.get(key)
-            if cache_data is not None:
-                return cache_data
-
-            result = func(*args, **kwargs)
-
-            cache_instance.set(key, result, expires)
-
-            return result
+            return get_or_set_cache(cache_instance, key, lambda: func(*args, **kwargs), timeout=expires,
+                                    stale_age=stale_age, jitter=jitter)
 
         return wrapper
 
@@ -5,6 +5,11 @@ import uuid
 
 from django.conf import settings
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 
 def ec(t):
     """默认编码字符串
@@ -33,6 +38,18 @@ def md5(t):
     return hashlib.md5(ec(t)).hexdigest()
 
 
+def fast_hash(t):
+    """快速非加密hash，用于缓存key等内部标识，安装xxhash时使用xxh3_128，否则使用blake2b
+
+    :param t: 字符串
+    :return: 32位十六进制hash值
+    """
+    if xxhash is not None and hasattr(xxhash, 'xxh3_128_hexdigest'):
+        return xxhash.xxh3_128_hexdigest(ec(t))
+
+    return hashlib.blake2b(ec(t), digest_size=16).hexdigest()
+
+
 def sha1(t):
     """默认sha1
 
@@ -1,3 +1,5 @@
+import heapq
+import logging
 import pickle
 import sched
 import threading
@@ -6,6 +8,8 @@ import time
 from django.core.cache import cache
 from sv_base.utils.base.text import md5
 
+logger = logging.getLogger(__name__)
+
 
 def async_exe(func, args=None, kwargs=None, delay=0, shared_config=None):
     """异步执行方法
@@ -128,3 +132,84 @@ def set_shared(shared_data):
 
 def register_shared(classes):
     shared_classes.update(classes)
+
+
+class TimerQueue:
+    """
+    定时执行队列，一个线程按时间顺序执行所有延时任务
+    """
+
+    def __init__(self, name='timer-queue'):
+        self.name = name
+        self._lock = threading.Condition()
+        self._heap = []
+        self._seq = 0
+        self._cancelled = set()
+        self._thread = None
+
+    def call_later(self, delay, func, args=None, kwargs=None):
+        """延时执行方法
+
+        :param delay: 执行延迟时间
+        :param func: 待执行方法
+        :param args: 方法args参数
+        :param kwargs: 方法kwargs参数
+        :return: 任务标识，用于取消
+        """
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.time() + delay, self._seq, func, args or (), kwargs or {}))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._lock.notify()
+
+            return self._seq
+
+    def cancel(self, task_id):
+        """取消延时任务
+
+        :param task_id: 任务标识
+        """
+        with self._lock:
+            if any(task[1] == task_id for task in self._heap):
+                self._cancelled.add(task_id)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._heap:
+                    self._lock.wait()
+
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    self._lock.wait(delay)
+                    continue
+
+                _, task_id, func, args, kwargs = heapq.heappop(self._heap)
+                if task_id in self._cancelled:
+                    self._cancelled.discard(task_id)
+                    continue
+
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.error('timer task[%s] error: %s', func, e)
+
+
+_timer_queue = None
+_timer_queue_lock = threading.Lock()
+
+
+def get_timer_queue():
+    """获取进程内共享的定时执行队列
+
+    :return: 定时执行队列
+    """
+    global _timer_queue
+    if _timer_queue is None:
+        with _timer_queue_lock:
+            if _timer_queue is None:
+                _timer_queue = TimerQueue()
+
+    return _timer_queue